@@ -3,9 +3,14 @@
 # http://inventwithpython.com/pygame
 # Released under a "Simplified BSD" license
 
-import random, pygame, math, time, sys
+import random, pygame, math, time, sys, os, collections, threading, struct, wave, argparse, json, zlib, lzma, queue, multiprocessing, mmap, sqlite3, glob
 from pygame.locals import *
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 TITLE = 'Mousie! v1.0'
 
 GAME_FPS = 15.0
@@ -17,6 +22,10 @@ WINDOWHEIGHT = CELLSIZE * 16
 CELLWIDTH = int(WINDOWWIDTH / CELLSIZE)
 CELLHEIGHT = int(WINDOWHEIGHT / CELLSIZE)
 MAXDISTANCE = math.sqrt ( CELLWIDTH ** 2 + CELLHEIGHT ** 2 )
+SPAWN_DIVISOR = 3.0  # cheese goes more than MAXDISTANCE / SPAWN_DIVISOR away
+SPAWN_TRIES = 1000   # random cells to try for the cheese before giving up
+VOLUME_SCALE = 6.0   # nav volume = 1 / (distance / MAXDISTANCE * VOLUME_SCALE + 1) ** VOLUME_POWER
+VOLUME_POWER = 2.0
 
 #             R    G    B
 WHITE     = (255, 255, 255)
@@ -35,19 +44,1836 @@ UP        = 'up'
 DOWN      = 'down'
 LEFT      = 'left'
 RIGHT     = 'right'
+NAVKEY    = 'nav'    # switch navigation mode
+SPACEKEY  = 'space'  # carry on after a win
+OTHERKEY  = 'other'
+HOTTER    = 'hotter'
+COLDER    = 'colder'
+
+# What the game engine makes of each key
+KEYMAP = {K_LEFT : LEFT, K_a : LEFT, K_RIGHT : RIGHT, K_d : RIGHT,
+          K_UP : UP, K_w : UP, K_DOWN : DOWN, K_s : DOWN,
+          K_n : NAVKEY, K_SPACE : SPACEKEY}
+
+MOVEKEYS = (K_LEFT, K_a, K_RIGHT, K_d, K_UP, K_w, K_DOWN, K_s)
+
+NAVMODES = 4
+class NavMode: Sound, Temperature, Direction, Stereo = range(NAVMODES)
+NAVTONEMODES = (NavMode.Sound, NavMode.Stereo) # modes that play the nav tone
+NAVMODENAMES = ('Sound', 'Temperature', 'Direction', 'Stereo')
+
+# Mixer channels kept back for ourselves, and cue priorities
+NAVCHANNEL = 0
+CUECHANNEL = 1
+CUE_NAV = 1
+CUE_WIN = 2
+
+class MonotonicClock:
+    # Seconds since the clock was made, from the high resolution monotonic
+    # counter so NTP adjustments can't bend win times.
+    virtual = False
+
+    def __init__(self):
+        self.start = time.perf_counter_ns()
+
+    def now(self):
+        return (time.perf_counter_ns() - self.start) / 1e9
+
+
+class VirtualClock:
+    # A clock that only moves when told to. The scheduler jumps it straight to
+    # the next deadline instead of sleeping, so games run as fast as possible.
+    virtual = True
+
+    def __init__(self):
+        self.ns = 0
+
+    def now(self):
+        return self.ns / 1e9
+
+    def step(self, seconds):
+        self.ns += int(round(seconds * 1e9))
+
+    def advanceTo(self, seconds):
+        self.ns = max(self.ns, int(math.ceil(seconds * 1e9)))
+
+
+class NavGainTable:
+    # Distance, Sound mode volume and Stereo mode left/right gains for every
+    # possible mouse to cheese offset, so a game tick only has to look them
+    # up. Rebuilt whenever the grid size or volume curve changes.
+
+    def __init__(self):
+        self.size = None
+        self.gains = {}
+
+    def lookup(self, dx, dy):
+        # dx, dy is where the cheese is relative to the mouse
+        if self.size != (CELLWIDTH, CELLHEIGHT, MAXDISTANCE, VOLUME_SCALE, VOLUME_POWER):
+            self.build()
+        return self.gains[(dx, dy)]
+
+    def build(self):
+        self.size = (CELLWIDTH, CELLHEIGHT, MAXDISTANCE, VOLUME_SCALE, VOLUME_POWER)
+        self.gains = {}
+        for dx in range(-(CELLWIDTH - 1), CELLWIDTH):
+            for dy in range(-(CELLHEIGHT - 1), CELLHEIGHT):
+                distance = math.sqrt(dx ** 2 + dy ** 2)
+                # Inverse distance squared, same as it always was
+                volume = 1.0 / ((distance / MAXDISTANCE * VOLUME_SCALE + 1.0) ** VOLUME_POWER)
+                # Constant power pan toward the cheese's side, scaled so
+                # dead ahead is as loud as the mono volume
+                pan = (float(dx) / max(CELLWIDTH - 1, 1) + 1.0) * math.pi / 4.0
+                left = min(1.0, volume * math.sqrt(2.0) * math.cos(pan))
+                right = min(1.0, volume * math.sqrt(2.0) * math.sin(pan))
+                self.gains[(dx, dy)] = (distance, volume, left, right)
+
+
+NAVGAINS = NavGainTable()
+
+
+class GameEngine:
+    # All the rules of the game, with no pygame, clock or sound in sight. The
+    # front end (or a simulation) hands it key changes and the time, calls
+    # step() at GAME_FPS and speak() at SPEAK_FPS, and reads the state back.
+    __slots__ = ('rng', 'score', 'justWon', 'paused', 'navMode',
+                 'mouseX', 'mouseY', 'prevX', 'prevY', 'cheeseX', 'cheeseY',
+                 'left', 'right', 'up', 'down',
+                 'distance', 'spokenDistance', 'volume', 'leftGain', 'rightGain', 'levels',
+                 'winTimer', 'winTime', 'lastWinTime', 'practice', 'lastWinPractice')
+
+    def __init__(self, now, rng=random, navMode=NavMode.Sound):
+        self.rng = rng
+        self.score = 0
+        self.justWon = True
+        self.paused = False
+        self.navMode = navMode
+        self.left = self.right = self.up = self.down = False
+        self.winTimer = now
+        self.winTime = 0.0
+        self.lastWinTime = 0.0
+        # The first win after starting or switching modes is a practice run
+        self.practice = True
+        self.lastWinPractice = True
+
+        # Set a random start point for the mouse somewhere near the center.
+        self.mouseX = self.prevX = rng.randint(5, CELLWIDTH - 6)
+        self.mouseY = self.prevY = rng.randint(5, CELLHEIGHT - 6)
+
+        # Set the cheese in a random place.
+        self.cheeseX, self.cheeseY = getRandomLocation((self.mouseX, self.mouseY), rng)
+
+        self.distance, self.volume, self.leftGain, self.rightGain = \
+            NAVGAINS.lookup(self.cheeseX - self.mouseX, self.cheeseY - self.mouseY)
+        self.spokenDistance = self.distance
+        if navMode in NAVTONEMODES:
+            self.levels = (0.1, 0.1)
+        else:
+            self.levels = (0.0, 0.0)
+
+    def press(self, key, down, now):
+        # A key went down or up. Keys take effect on the next step().
+
+        # Don't reset the timer until they've pressed the
+        # first key after winning
+        if self.justWon and key != SPACEKEY:
+            self.justWon = False
+            self.winTimer = now
+
+        if key == LEFT:
+            self.left = down
+        elif key == RIGHT:
+            self.right = down
+        elif key == UP:
+            self.up = down
+        elif key == DOWN:
+            self.down = down
+        elif key == NAVKEY and down:
+            self.practice = True
+            self.navMode = (self.navMode + 1) % NAVMODES
+            if self.navMode not in NAVTONEMODES:
+                self.levels = (0.0, 0.0)
+            else:
+                self.levels = (0.1, 0.1)
+
+    def resume(self):
+        # Carry on after a win, with all keys let go
+        self.paused = False
+        self.left = self.right = self.up = self.down = False
+        if self.navMode in NAVTONEMODES:
+            self.levels = (0.1, 0.1)
+
+    def step(self, now):
+        # One game tick. Returns True if the mouse ate the cheese.
+        self.prevX = self.mouseX
+        self.prevY = self.mouseY
+        won = False
+
+        # Did the mouse eat the cheese?
+        if self.mouseX == self.cheeseX and self.mouseY == self.cheeseY:
+
+            # Flag as just won so timer doesn't start again until key press
+            self.justWon = True
+            self.lastWinTime = self.winTime
+            self.lastWinPractice = self.practice
+            self.practice = False
+            self.score = self.score + 1
+
+            # Move the cheese
+            self.cheeseX, self.cheeseY = getRandomLocation((self.mouseX, self.mouseY), self.rng)
+
+            # Pause game and turn off sound if it was playing
+            self.paused = True
+            if self.navMode in NAVTONEMODES:
+                self.levels = (0.0, 0.0)
+            won = True
+
+        # Move the mouse by updating its position based on the key state.
+        if self.left and self.mouseX > 0:
+            self.mouseX = self.mouseX - 1
+        if self.right and self.mouseX < CELLWIDTH - 1:
+            self.mouseX = self.mouseX + 1
+        if self.up and self.mouseY > 0:
+            self.mouseY = self.mouseY - 1
+        if self.down and self.mouseY < CELLHEIGHT - 1:
+            self.mouseY = self.mouseY + 1
+
+        # Find the distance between the mouse and the cheese, and how
+        # loud the nav tone should be in each ear
+        self.distance, self.volume, self.leftGain, self.rightGain = \
+            NAVGAINS.lookup(self.cheeseX - self.mouseX, self.cheeseY - self.mouseY)
+        if self.navMode in NAVTONEMODES and not self.paused:
+            if self.navMode == NavMode.Sound:
+                self.levels = (self.volume, self.volume)
+            else:
+                self.levels = (self.leftGain, self.rightGain)
+
+        if self.justWon:
+            self.winTime = 0.0
+        else:
+            self.winTime = now - self.winTimer
+        return won
+
+    def speak(self):
+        # The spoken cue for this SPEAK_FPS tick (HOTTER, COLDER, LEFT,
+        # RIGHT, UP, DOWN) or None
+        cue = None
+        if self.navMode == NavMode.Temperature:
+            if self.spokenDistance > self.distance:
+                # Getting closer to cheese.
+                cue = HOTTER
+            elif self.spokenDistance < self.distance:
+                # Getting farther from the cheese.
+                cue = COLDER
+        elif self.navMode == NavMode.Direction:
+            cue = getDirectionCue(self.mouseX, self.mouseY, self.cheeseX, self.cheeseY)
+        self.spokenDistance = self.distance
+        return cue
+
+    def cueHolds(self, cue, fromDistance):
+        # Is cue, decided when the last cue was at fromDistance, still true?
+        if cue == HOTTER:
+            return self.navMode == NavMode.Temperature and self.distance < fromDistance
+        if cue == COLDER:
+            return self.navMode == NavMode.Temperature and self.distance > fromDistance
+        return (self.navMode == NavMode.Direction and
+                getDirectionCue(self.mouseX, self.mouseY, self.cheeseX, self.cheeseY) == cue)
+
+    def moving(self):
+        return self.left or self.right or self.up or self.down
+
+
+class TrialRecorder:
+    # Watches a GameEngine and writes down one record per cheese eaten, the
+    # same way for real sessions and scripted players. Call step() after
+    # every GameEngine.step().
+    #
+    # Besides the time it keeps how well the mouse was steered: cells moved,
+    # how many of those moves went back to a cell already visited (one bit
+    # per cell), and the shortest path, which with diagonal moves is the
+    # larger of the x and y distances.
+
+    def __init__(self, engine):
+        self.trials = []
+        self.begin(engine, (engine.mouseX, engine.mouseY))
+
+    def begin(self, engine, start):
+        self.engine = engine
+        self.start = start
+        self.cheese = (engine.cheeseX, engine.cheeseY)
+        self.navMode = engine.navMode
+        self.steps = 0
+        self.pathLength = 0
+        self.revisits = 0
+        self.optimalLength = max(abs(self.cheese[0] - start[0]), abs(self.cheese[1] - start[1]))
+        self.visited = bytearray((CELLWIDTH * CELLHEIGHT + 7) // 8)
+        self.visit(start[0], start[1])
+
+    def visit(self, x, y):
+        # Mark a cell, returning True if it was already marked
+        cell = y * CELLWIDTH + x
+        bit = 1 << (cell & 7)
+        seen = self.visited[cell >> 3] & bit
+        self.visited[cell >> 3] |= bit
+        return seen != 0
+
+    def efficiency(self):
+        # Shortest path over path taken, 1.0 is perfect
+        if self.pathLength == 0:
+            return 1.0
+        return min(1.0, self.optimalLength / float(self.pathLength))
+
+    def step(self, won):
+        engine = self.engine
+        if won:
+            self.trials.append({'navMode': NAVMODENAMES[self.navMode],
+                                'winTime': engine.lastWinTime,
+                                'start': self.start,
+                                'cheese': self.cheese,
+                                'steps': self.steps,
+                                'pathLength': self.pathLength,
+                                'revisits': self.revisits,
+                                'optimalLength': self.optimalLength,
+                                'efficiency': self.efficiency(),
+                                'practice': engine.lastWinPractice})
+            self.begin(engine, (engine.prevX, engine.prevY))
+        elif engine.navMode != self.navMode:
+            # Switching modes starts the trial over
+            self.begin(engine, (engine.prevX, engine.prevY))
+        self.steps += 1
+        if engine.mouseX != engine.prevX or engine.mouseY != engine.prevY:
+            self.pathLength += 1
+            if self.visit(engine.mouseX, engine.mouseY):
+                self.revisits += 1
+
+
+def summarizeTrials(trials, title='trials'):
+    # Count, mean and median win time, path length and efficiency per mode,
+    # leaving out practice runs
+    byMode = collections.OrderedDict()
+    for trial in trials:
+        if not trial['practice']:
+            byMode.setdefault(trial['navMode'], []).append(trial)
+    lines = []
+    for navMode, modeTrials in byMode.items():
+        winTimes = sorted(trial['winTime'] for trial in modeTrials)
+        lines.append('%s, %s: %d trials, win time mean %.2f median %.2f secs, path %.1f cells, efficiency %.2f'
+                     % (title, navMode, len(winTimes), sum(winTimes) / len(winTimes),
+                        winTimes[len(winTimes) // 2],
+                        sum(trial['pathLength'] for trial in modeTrials) / float(len(modeTrials)),
+                        sum(trial['efficiency'] for trial in modeTrials) / float(len(modeTrials))))
+    return '\n'.join(lines)
+
+
+class P2Quantile:
+    # Estimates the p quantile of a stream in constant memory with the P²
+    # algorithm (Jain and Chlamtac): five markers whose heights are nudged
+    # along a parabola as values come in. Exact until there are five.
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1.0, 1.0 + 2.0 * p, 1.0 + 4.0 * p, 3.0 + 2.0 * p, 5.0]
+        self.increments = (0.0, p / 2.0, p, (1.0 + p) / 2.0, 1.0)
+
+    def add(self, x):
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(x)
+            heights.sort()
+            return
+
+        # Find the cell x falls in, stretching the ends if need be
+        if x < heights[0]:
+            heights[0] = x
+            cell = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            cell = 3
+        else:
+            cell = 0
+            while x >= heights[cell + 1]:
+                cell += 1
+        positions = self.positions
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers toward where they should be
+        for i in (1, 2, 3):
+            d = self.desired[i] - positions[i]
+            if (d >= 1.0 and positions[i + 1] - positions[i] > 1) or \
+               (d <= -1.0 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0 else -1
+                height = heights[i] + d / float(positions[i + 1] - positions[i - 1]) * \
+                    ((positions[i] - positions[i - 1] + d) * (heights[i + 1] - heights[i]) /
+                     float(positions[i + 1] - positions[i]) +
+                     (positions[i + 1] - positions[i] - d) * (heights[i] - heights[i - 1]) /
+                     float(positions[i] - positions[i - 1]))
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + d * (heights[i + d] - heights[i]) / \
+                        float(positions[i + d] - positions[i])
+                heights[i] = height
+                positions[i] += d
+
+    def value(self):
+        heights = self.heights
+        if not heights:
+            return None
+        if len(heights) < 5:
+            return heights[int(round(self.p * (len(heights) - 1)))]
+        return heights[2]
+
+
+class RunningStats:
+    # Count, mean and variance by Welford's method plus P² median and
+    # 90th percentile, in constant memory and time per value
+    QUANTILES = (0.5, 0.9)
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.sumSquares = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.quantiles = [P2Quantile(p) for p in self.QUANTILES]
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.sumSquares += delta * (x - self.mean)
+        if self.count == 1:
+            self.minimum = self.maximum = x
+        else:
+            self.minimum = min(self.minimum, x)
+            self.maximum = max(self.maximum, x)
+        for quantile in self.quantiles:
+            quantile.add(x)
+
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self.sumSquares / (self.count - 1)
+
+    def summary(self):
+        summary = {'count': self.count, 'mean': self.mean, 'std': math.sqrt(self.variance()),
+                   'min': self.minimum, 'max': self.maximum}
+        for quantile in self.quantiles:
+            summary['p%d' % round(quantile.p * 100)] = quantile.value()
+        return summary
+
+
+class WinTimeStats:
+    # Running win time statistics for each participant and nav mode,
+    # leaving out practice runs
+    def __init__(self):
+        self.stats = collections.OrderedDict()
+
+    def add(self, participant, trial):
+        if not trial['practice']:
+            key = (participant, trial['navMode'])
+            if key not in self.stats:
+                self.stats[key] = RunningStats()
+            self.stats[key].add(trial['winTime'])
+
+    def get(self, participant, navMode):
+        return self.stats.get((participant, NAVMODENAMES[navMode]))
+
+    def export(self, path):
+        summaries = [dict(participant=participant, navMode=navMode, **stats.summary())
+                     for (participant, navMode), stats in self.stats.items()]
+        with open(path, 'w') as statsFile:
+            json.dump(summaries, statsFile, indent=1)
+
+    def report(self):
+        lines = []
+        for (participant, navMode), stats in self.stats.items():
+            summary = stats.summary()
+            lines.append('%s, %s: %d trials, win time mean %.2f sd %.2f median %.2f p90 %.2f secs'
+                         % (participant, navMode, summary['count'], summary['mean'], summary['std'],
+                            summary['p50'], summary['p90']))
+        return '\n'.join(lines)
+
+
+# What a session recording can say, each op packed with a 32 bit value
+SESSIONOP = struct.Struct('<BI')
+OP_TIME, OP_PRESS, OP_STEP, OP_SPEAK, OP_RESUME = range(5)
+ENGINEKEYS = (LEFT, RIGHT, UP, DOWN, NAVKEY, SPACEKEY, OTHERKEY)
+
+
+class SessionRecorder:
+    # Sits in front of a GameEngine and keeps every call made on it, so a
+    # session can be played again exactly. Engine times are whole
+    # microseconds since the session started, so the replay hands the
+    # engine the very same numbers.
+
+    def __init__(self, seed, start, navMode=NavMode.Sound):
+        self.seed = seed
+        self.start = start
+        self.name = '%s-%d' % (time.strftime('%Y%m%d-%H%M%S'), seed)
+        self.micros = 0
+        self.ops = bytearray()
+        self.cues = []
+        self.engine = GameEngine(0.0, random.Random(seed), navMode)
+
+    def time(self, now):
+        # Move the engine's time up to now (a CLOCK time) for the presses and
+        # step that follow, and return it
+        micros = max(self.micros, int(round((now - self.start) * 1000000)))
+        delta = micros - self.micros
+        while delta > 0xffffffff:
+            self.ops += SESSIONOP.pack(OP_TIME, 0xffffffff)
+            delta -= 0xffffffff
+        if delta:
+            self.ops += SESSIONOP.pack(OP_TIME, delta)
+        self.micros = micros
+        return micros / 1000000.0
+
+    def press(self, key, down):
+        self.ops += SESSIONOP.pack(OP_PRESS, ENGINEKEYS.index(key) * 2 + bool(down))
+        self.engine.press(key, down, self.micros / 1000000.0)
+
+    def step(self):
+        self.ops += SESSIONOP.pack(OP_STEP, 0)
+        return self.engine.step(self.micros / 1000000.0)
+
+    def speak(self):
+        self.ops += SESSIONOP.pack(OP_SPEAK, 0)
+        cue = self.engine.speak()
+        self.cues.append(cue)
+        return cue
+
+    def resume(self):
+        self.ops += SESSIONOP.pack(OP_RESUME, 0)
+        self.engine.resume()
+
+    def save(self, path, trials):
+        # A JSON line saying how to set up and what should come out, then
+        # the ops, compressed. This is called again on every capture, so the
+        # new file replaces the old one only once it is all written.
+        header = {'seed': self.seed,
+                  'settings': dict((name, globals()[name]) for name in SWEEP_SETTINGS if name != 'navMode'),
+                  'score': self.engine.score,
+                  'captureTimes': [trial['winTime'] for trial in trials],
+                  'cues': self.cues}
+        with open(path + '.tmp', 'wb') as sessionFile:
+            sessionFile.write(json.dumps(header).encode('utf-8') + b'\n')
+            sessionFile.write(zlib.compress(bytes(self.ops)))
+        os.replace(path + '.tmp', path)
+
+
+def replaySession(path, speed=0.0):
+    # Play a recorded session again with no window or sound, speed times as
+    # fast as it was played (0 = flat out), and check it comes out the same.
+    # Returns True if it does.
+    with open(path, 'rb') as sessionFile:
+        header = json.loads(sessionFile.readline().decode('utf-8'))
+        ops = zlib.decompress(sessionFile.read())
+    applySettings(header['settings'])
+
+    engine = GameEngine(0.0, random.Random(header['seed']))
+    trials = TrialRecorder(engine)
+    cues = []
+    micros = 0
+    now = 0.0
+    wallStart = time.perf_counter()
+    for op, value in SESSIONOP.iter_unpack(ops):
+        if op == OP_TIME:
+            micros += value
+            now = micros / 1000000.0
+            if speed > 0:
+                delay = wallStart + now / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        elif op == OP_PRESS:
+            engine.press(ENGINEKEYS[value // 2], bool(value % 2), now)
+        elif op == OP_STEP:
+            trials.step(engine.step(now))
+        elif op == OP_SPEAK:
+            cues.append(engine.speak())
+        elif op == OP_RESUME:
+            engine.resume()
+
+    captureTimes = [trial['winTime'] for trial in trials.trials]
+    print('%s: %.1f secs of play, replayed in %.2f secs' % (path, now, time.perf_counter() - wallStart))
+    matches = True
+    for name, recorded, replayed in (('score', header['score'], engine.score),
+                                     ('capture times', header['captureTimes'], captureTimes),
+                                     ('cues', header['cues'], cues)):
+        if recorded == replayed:
+            print('  %s match' % name)
+        else:
+            print('  %s DIFFER: recorded %r, replayed %r' % (name, recorded, replayed))
+            matches = False
+    return matches
+
+
+# One telemetry record per game tick. The header is a magic number and how
+# many records follow. Cues are 0 for none, else 1 + their place in
+# TELEMETRYCUES. Compressed logs are a run of blocks, each a TELEMETRYBLOCK
+# (compressed bytes, records) and then the compressed records.
+TELEMETRYHEADER = struct.Struct('<8sQ')
+TELEMETRYMAGIC = b'MOUSETL1'
+TELEMETRYCODECS = {'zlib' : (b'MOUSETLZ', zlib), 'lzma' : (b'MOUSETLX', lzma)}
+TELEMETRYBLOCK = struct.Struct('<II')
+TELEMETRYRECORD = struct.Struct('<dhhhhffBBBx')
+TELEMETRYCUES = (HOTTER, COLDER, LEFT, RIGHT, UP, DOWN, 'won')
+TELEMETRY_PAUSED, TELEMETRY_WON = 1, 2
+if numpy is not None:
+    TELEMETRY_DTYPE = numpy.dtype([('time', '<f8'), ('mouseX', '<i2'), ('mouseY', '<i2'),
+                                   ('cheeseX', '<i2'), ('cheeseY', '<i2'),
+                                   ('distance', '<f4'), ('volume', '<f4'),
+                                   ('navMode', 'u1'), ('cue', 'u1'), ('flags', 'u1'), ('pad', 'u1')])
+
+
+class TelemetryLog:
+    # Copies packed records straight into a memory mapped file. The file is
+    # made TELEMETRY_CHUNK bytes bigger whenever it fills up and cut down to
+    # what was written on close().
+
+    def __init__(self, path):
+        self.file = open(path, 'w+b')
+        self.count = 0
+        self.offset = TELEMETRYHEADER.size
+        self.size = 0
+        self.map = None
+        self.grow()
+
+    def grow(self):
+        if self.map is not None:
+            self.map.close()
+        self.size += TELEMETRY_CHUNK
+        self.file.truncate(self.size)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        TELEMETRYHEADER.pack_into(self.map, 0, TELEMETRYMAGIC, self.count)
+
+    def write(self, records, count):
+        while self.offset + len(records) > self.size:
+            self.grow()
+        self.map[self.offset:self.offset + len(records)] = records
+        self.offset += len(records)
+        self.count += count
+        # Keep the count current so a log cut short by a crash still reads
+        TELEMETRYHEADER.pack_into(self.map, 0, TELEMETRYMAGIC, self.count)
+
+    def close(self):
+        if self.map is None:
+            return
+        self.map.flush()
+        self.map.close()
+        self.map = None
+        self.file.truncate(self.offset)
+        self.file.close()
+
+
+class CompressedTelemetryLog:
+    # Compresses each batch of packed records into a block of its own, so a
+    # log cut short by a crash still reads up to its last whole block
+
+    def __init__(self, path, codec):
+        self.magic, self.codec = TELEMETRYCODECS[codec]
+        self.file = open(path, 'wb')
+        self.count = 0
+        self.file.write(TELEMETRYHEADER.pack(self.magic, self.count))
 
-NAVMODES = 3
-class NavMode: Sound, Temperature, Direction = range(NAVMODES)
+    def write(self, records, count):
+        block = self.codec.compress(bytes(records))
+        self.file.write(TELEMETRYBLOCK.pack(len(block), count))
+        self.file.write(block)
+        self.file.flush()
+        self.count += count
 
-def main():
-    global FPSCLOCK, DISPLAYSURF, BASICFONT
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.seek(0)
+        self.file.write(TELEMETRYHEADER.pack(self.magic, self.count))
+        self.file.close()
+
+
+class TelemetryWriter:
+    # The game thread packs a record per tick and hands it over through a
+    # bounded queue, and never waits for it: when the queue is full the
+    # record is dropped and counted. A thread of its own batches the records
+    # and writes them to the log, so a slow disk can't hold up a tick.
+
+    def __init__(self, path, codec=None):
+        if codec is None:
+            codec = TELEMETRY_COMPRESS
+        if codec:
+            self.log = CompressedTelemetryLog(path, codec)
+        else:
+            self.log = TelemetryLog(path)
+        self.records = queue.Queue(TELEMETRY_QUEUE)
+        self.added = 0
+        self.dropped = 0
+        self.batches = 0
+        self.writeTime = 0.0
+        self.maxWriteTime = 0.0
+        self.thread = threading.Thread(target=self.run, name='telemetry')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, engine, now, cue, won):
+        if cue is None:
+            cueCode = 0
+        else:
+            cueCode = TELEMETRYCUES.index(cue) + 1
+        record = TELEMETRYRECORD.pack(now, engine.mouseX, engine.mouseY, engine.cheeseX, engine.cheeseY,
+                                      engine.distance, engine.volume, engine.navMode, cueCode,
+                                      engine.paused * TELEMETRY_PAUSED | won * TELEMETRY_WON)
+        try:
+            self.records.put_nowait(record)
+            self.added += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        batch = bytearray()
+        count = 0
+        flushTime = time.perf_counter() + TELEMETRY_FLUSH_SECONDS
+        while True:
+            try:
+                record = self.records.get(timeout=max(0.0, flushTime - time.perf_counter()))
+            except queue.Empty:
+                record = b''
+            if record is None:
+                break
+            if record:
+                batch += record
+                count += 1
+            if len(batch) >= TELEMETRY_BATCH or (count and time.perf_counter() >= flushTime):
+                self.flush(batch, count)
+                batch = bytearray()
+                count = 0
+            if time.perf_counter() >= flushTime:
+                flushTime = time.perf_counter() + TELEMETRY_FLUSH_SECONDS
+        if count:
+            self.flush(batch, count)
+        self.log.close()
+
+    def flush(self, batch, count):
+        startTime = time.perf_counter()
+        self.log.write(batch, count)
+        elapsed = time.perf_counter() - startTime
+        self.batches += 1
+        self.writeTime += elapsed
+        self.maxWriteTime = max(self.maxWriteTime, elapsed)
+
+    def close(self):
+        # Write out whatever is waiting and close the log
+        if self.thread.is_alive():
+            self.records.put(None)
+            self.thread.join()
+
+    def report(self):
+        if self.added + self.dropped == 0:
+            return ''
+        return ('telemetry: %d records in %d batches, %d dropped, write avg %.1f ms max %.1f ms'
+                % (self.added, self.batches, self.dropped,
+                   self.writeTime * 1000.0 / max(1, self.batches), self.maxWriteTime * 1000.0))
+
+
+def readTelemetry(path):
+    # A finished (or crashed) telemetry log as a numpy structured array. For
+    # an uncompressed log it's a view on the file, nothing is copied or parsed.
+    with open(path, 'rb') as telemetryFile:
+        magic, count = TELEMETRYHEADER.unpack(telemetryFile.read(TELEMETRYHEADER.size))
+        for codecMagic, codec in TELEMETRYCODECS.values():
+            if magic == codecMagic:
+                blocks = []
+                while True:
+                    blockHeader = telemetryFile.read(TELEMETRYBLOCK.size)
+                    if len(blockHeader) < TELEMETRYBLOCK.size:
+                        break
+                    size, blockCount = TELEMETRYBLOCK.unpack(blockHeader)
+                    block = telemetryFile.read(size)
+                    if len(block) < size:
+                        break
+                    blocks.append(codec.decompress(block))
+                return numpy.frombuffer(b''.join(blocks), dtype=TELEMETRY_DTYPE)
+    if magic != TELEMETRYMAGIC:
+        raise ValueError('%s is not a telemetry log' % path)
+    if count == 0:
+        return numpy.zeros(0, dtype=TELEMETRY_DTYPE)
+    return numpy.memmap(path, dtype=TELEMETRY_DTYPE, mode='r',
+                        offset=TELEMETRYHEADER.size, shape=(count,))
+
+
+def summarizeTelemetry(path):
+    if numpy is None:
+        print('Reading telemetry needs numpy', file=sys.stderr)
+        return
+    startTime = time.perf_counter()
+    ticks = readTelemetry(path)
+    lines = ['%s: %d ticks over %.1f secs' % (path, len(ticks), ticks['time'][-1] if len(ticks) else 0.0)]
+    playing = (ticks['flags'] & TELEMETRY_PAUSED) == 0
+    for navMode, name in enumerate(NAVMODENAMES):
+        inMode = playing & (ticks['navMode'] == navMode)
+        if inMode.any():
+            lines.append('  %s: %d ticks, %d wins, %d cues, mean distance %.2f' %
+                         (name, inMode.sum(),
+                          ((ticks['flags'] & TELEMETRY_WON) != 0)[ticks['navMode'] == navMode].sum(),
+                          (ticks['cue'][inMode] != 0).sum(), ticks['distance'][inMode].mean()))
+    lines.append('  read in %.1f ms' % ((time.perf_counter() - startTime) * 1000.0))
+    print('\n'.join(lines))
+
+
+class ResultsStore:
+    # Keeps every trial in a SQLite database, for comparing modes across
+    # participants and sessions. Trials are held back and written in one
+    # transaction per block: when the nav mode changes, RESULTS_BATCH have
+    # built up, or on close().
+    COLUMNS = ('participant', 'session', 'time', 'navMode', 'winTime', 'startX', 'startY',
+               'cheeseX', 'cheeseY', 'steps', 'pathLength', 'practice',
+               'revisits', 'optimalLength', 'efficiency')
+
+    def __init__(self, path, participant, session):
+        self.participant = participant
+        self.session = session
+        self.pending = []
+        self.db = sqlite3.connect(path)
+        # Write ahead logging lets the dashboard read while a game writes
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS trials (id INTEGER PRIMARY KEY, '
+                        'participant TEXT, session TEXT, time REAL, navMode TEXT, winTime REAL, '
+                        'startX INTEGER, startY INTEGER, cheeseX INTEGER, cheeseY INTEGER, '
+                        'steps INTEGER, pathLength INTEGER, practice INTEGER, '
+                        'revisits INTEGER, optimalLength INTEGER, efficiency REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS trialsByMode ON trials (participant, navMode)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS trialsBySession ON trials (session, time)')
+        self.db.commit()
+
+    def add(self, trial):
+        if self.pending and self.pending[-1][3] != trial['navMode']:
+            self.flush()
+        self.pending.append((self.participant, self.session, time.time(), trial['navMode'],
+                             trial['winTime'], trial['start'][0], trial['start'][1],
+                             trial['cheese'][0], trial['cheese'][1], trial['steps'],
+                             trial['pathLength'], int(trial['practice']),
+                             trial['revisits'], trial['optimalLength'], trial['efficiency']))
+        if len(self.pending) >= RESULTS_BATCH:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with self.db:
+                self.db.executemany('INSERT INTO trials (%s) VALUES (%s)' %
+                                    (', '.join(self.COLUMNS), ', '.join('?' * len(self.COLUMNS))),
+                                    self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def summarizeResults(path):
+    # Trials, mean and best win time and mean path efficiency for each
+    # participant and mode, leaving out practice runs
+    db = sqlite3.connect(path)
+    startTime = time.perf_counter()
+    rows = db.execute('SELECT participant, navMode, COUNT(*), AVG(winTime), MIN(winTime), AVG(efficiency) '
+                      'FROM trials WHERE practice = 0 GROUP BY participant, navMode').fetchall()
+    elapsed = time.perf_counter() - startTime
+    db.close()
+    for participant, navMode, count, meanTime, bestTime, efficiency in rows:
+        if efficiency is None:
+            efficiency = float('nan')
+        print('%s, %s: %d trials, win time mean %.2f best %.2f secs, efficiency %.2f' %
+              (participant, navMode, count, meanTime, bestTime, efficiency))
+    print('(queried in %.1f ms)' % (elapsed * 1000.0))
+
+
+class VisitHeatmaps:
+    # How many game ticks the mouse spent in each cell, kept as a numpy
+    # array for each nav mode, grid size and frame: 'absolute' is the grid
+    # itself, 'relative' is centred on the cheese (so it is twice as big,
+    # less one). Sessions are kept apart while playing and added together
+    # whole arrays at a time.
+    FRAMES = ('absolute', 'relative')
+
+    def __init__(self):
+        self.maps = {}
+
+    def counts(self, navModeName, width, height, frame):
+        key = '%s-%dx%d-%s' % (navModeName, width, height, frame)
+        if key not in self.maps:
+            if frame == 'absolute':
+                self.maps[key] = numpy.zeros((height, width), dtype=numpy.int64)
+            else:
+                self.maps[key] = numpy.zeros((2 * height - 1, 2 * width - 1), dtype=numpy.int64)
+        return self.maps[key]
+
+    def visit(self, engine):
+        # One tick of play, counted in place
+        name = NAVMODENAMES[engine.navMode]
+        self.counts(name, CELLWIDTH, CELLHEIGHT, 'absolute')[engine.mouseY, engine.mouseX] += 1
+        self.counts(name, CELLWIDTH, CELLHEIGHT, 'relative')[
+            engine.mouseY - engine.cheeseY + CELLHEIGHT - 1,
+            engine.mouseX - engine.cheeseX + CELLWIDTH - 1] += 1
+
+    def addTelemetry(self, ticks, width, height):
+        # Count a whole telemetry log at once, the same ticks visit() counts
+        playing = ticks[(ticks['flags'] & TELEMETRY_PAUSED) == 0]
+        mouseX = playing['mouseX'].astype(numpy.int64)
+        mouseY = playing['mouseY'].astype(numpy.int64)
+        relativeX = mouseX - playing['cheeseX'] + width - 1
+        relativeY = mouseY - playing['cheeseY'] + height - 1
+        for navMode in numpy.unique(playing['navMode']):
+            inMode = playing['navMode'] == navMode
+            name = NAVMODENAMES[navMode]
+            absolute = self.counts(name, width, height, 'absolute')
+            absolute += numpy.bincount(mouseY[inMode] * width + mouseX[inMode],
+                                       minlength=absolute.size).reshape(absolute.shape)
+            relative = self.counts(name, width, height, 'relative')
+            relative += numpy.bincount(relativeY[inMode] * relative.shape[1] + relativeX[inMode],
+                                       minlength=relative.size).reshape(relative.shape)
+
+    def merge(self, other):
+        for key, counts in other.maps.items():
+            if key in self.maps:
+                self.maps[key] += counts
+            else:
+                self.maps[key] = counts.copy()
+
+    def save(self, path):
+        with open(path, 'wb') as heatmapFile:
+            numpy.savez_compressed(heatmapFile, **self.maps)
+
+    @classmethod
+    def load(cls, path):
+        heatmaps = cls()
+        with numpy.load(path) as saved:
+            for key in saved.files:
+                heatmaps.maps[key] = saved[key]
+        return heatmaps
+
+
+def sessionHeatmaps(stem):
+    # The heatmaps of the session saved as stem + '.session', '.telemetry'
+    # and so on. Totals are kept in stem + '.heatmap.npz': a game writes them
+    # as it ends, otherwise they are worked out from the telemetry log once.
+    cachePath = stem + '.heatmap.npz'
+    telemetryPath = stem + '.telemetry'
+    if os.path.exists(cachePath) and (not os.path.exists(telemetryPath) or
+                                      os.path.getmtime(cachePath) >= os.path.getmtime(telemetryPath)):
+        return VisitHeatmaps.load(cachePath)
+
+    # The grid size comes from the session's settings, if it was recorded
+    cellSize = CELLSIZE
+    if os.path.exists(stem + '.session'):
+        with open(stem + '.session', 'rb') as sessionFile:
+            cellSize = int(json.loads(sessionFile.readline().decode('utf-8'))['settings']['CELLSIZE'])
+    heatmaps = VisitHeatmaps()
+    heatmaps.addTelemetry(readTelemetry(telemetryPath),
+                          int(WINDOWWIDTH / cellSize), int(WINDOWHEIGHT / cellSize))
+    heatmaps.save(cachePath)
+    return heatmaps
+
+
+def mergeHeatmaps(directory):
+    total = VisitHeatmaps()
+    stems = set()
+    for pattern, ending in (('*.telemetry', '.telemetry'), ('*.heatmap.npz', '.heatmap.npz')):
+        for path in glob.glob(os.path.join(directory, pattern)):
+            stems.add(path[:-len(ending)])
+    for stem in sorted(stems):
+        total.merge(sessionHeatmaps(stem))
+    return total, len(stems)
+
+
+def renderHeatmap(counts, path, cellPixels=CELLSIZE):
+    # Black through red and yellow to white on a log scale, one square of
+    # cellPixels per cell
+    level = numpy.log1p(counts.astype(numpy.float64))
+    if level.max() > 0:
+        level /= level.max()
+    rgb = numpy.empty(counts.shape + (3,), dtype=numpy.uint8)
+    for channel in range(3):
+        rgb[:, :, channel] = numpy.clip(level * 3.0 - channel, 0.0, 1.0) * 255
+    rgb = rgb.repeat(cellPixels, axis=0).repeat(cellPixels, axis=1)
+    # surfarray wants x first
+    pygame.image.save(pygame.surfarray.make_surface(rgb.transpose(1, 0, 2)), path)
+
+
+def showHeatmaps(directory, keys):
+    # Add up every session's heatmaps in directory and save the ones asked
+    # for (all of them if none are) as heatmap-<key>.png
+    if numpy is None:
+        print('Heatmaps need numpy', file=sys.stderr)
+        return
+    startTime = time.perf_counter()
+    total, sessions = mergeHeatmaps(directory)
+    print('%d sessions merged in %.1f ms' % (sessions, (time.perf_counter() - startTime) * 1000.0))
+    for key in sorted(total.maps):
+        print('  %s: %d ticks' % (key, total.maps[key].sum()))
+    for key in keys or sorted(total.maps):
+        if key not in total.maps:
+            print('No heatmap called %s' % key, file=sys.stderr)
+            continue
+        cellPixels = max(1, int(CELLSIZE / 2)) if key.endswith('relative') else CELLSIZE
+        renderHeatmap(total.maps[key], 'heatmap-%s.png' % key, cellPixels)
+        print('saved heatmap-%s.png' % key)
+
+
+# Direction cues as numbers, for the batch simulator
+DIRECTIONCODES = (None, RIGHT, LEFT, DOWN, UP)
+
+
+class BatchSimulator:
+    # Lots of games at once, one mouse each, kept in numpy arrays and all
+    # stepped together with the same rules as GameEngine. Set the left,
+    # right, up and down arrays and call step() at GAME_FPS and speak() at
+    # SPEAK_FPS. A mouse that eats its cheese carries straight on with its
+    # keys let go, like pressing space right away.
+
+    def __init__(self, count, seed=None):
+        rng = self.rng = numpy.random.default_rng(seed)
+        self.count = count
+        self.mouseX = rng.integers(5, CELLWIDTH - 5, count)
+        self.mouseY = rng.integers(5, CELLHEIGHT - 5, count)
+        self.cheeseX = numpy.zeros(count, dtype=self.mouseX.dtype)
+        self.cheeseY = numpy.zeros(count, dtype=self.mouseY.dtype)
+        self.respawn(numpy.ones(count, dtype=bool))
+        self.left = numpy.zeros(count, dtype=bool)
+        self.right = numpy.zeros(count, dtype=bool)
+        self.up = numpy.zeros(count, dtype=bool)
+        self.down = numpy.zeros(count, dtype=bool)
+        self.score = numpy.zeros(count, dtype=numpy.int64)
+        # Like GameEngine's win timer, a mouse's clock starts with the first
+        # key after a win
+        self.stepsSinceWin = numpy.zeros(count, dtype=numpy.int64)
+        self.timing = numpy.zeros(count, dtype=bool)
+        self.winSteps = numpy.zeros(count, dtype=numpy.int64) # total steps it took to win
+        self.winStepsSq = numpy.zeros(count, dtype=numpy.int64)
+
+        # Distance, Sound mode volume and Stereo mode gains for every
+        # offset, from NAVGAINS
+        shape = (2 * CELLWIDTH - 1, 2 * CELLHEIGHT - 1)
+        self.distanceTable = numpy.zeros(shape)
+        self.volumeTable = numpy.zeros(shape)
+        self.leftTable = numpy.zeros(shape)
+        self.rightTable = numpy.zeros(shape)
+        for dx in range(-(CELLWIDTH - 1), CELLWIDTH):
+            for dy in range(-(CELLHEIGHT - 1), CELLHEIGHT):
+                distance, volume, left, right = NAVGAINS.lookup(dx, dy)
+                self.distanceTable[dx + CELLWIDTH - 1, dy + CELLHEIGHT - 1] = distance
+                self.volumeTable[dx + CELLWIDTH - 1, dy + CELLHEIGHT - 1] = volume
+                self.leftTable[dx + CELLWIDTH - 1, dy + CELLHEIGHT - 1] = left
+                self.rightTable[dx + CELLWIDTH - 1, dy + CELLHEIGHT - 1] = right
+        self.lookup()
+        self.spokenDistance = self.distance.copy()
+
+        self.steps = 0
+        self.stepTime = 0.0
+
+    def respawn(self, which):
+        # getRandomLocation() for every mouse in which: keep drawing until the
+        # cheese is far enough away
+        todo = numpy.flatnonzero(which)
+        for attempt in range(SPAWN_TRIES):
+            if todo.size == 0:
+                return
+            x = self.rng.integers(0, CELLWIDTH, todo.size)
+            y = self.rng.integers(0, CELLHEIGHT, todo.size)
+            farEnough = numpy.sqrt((x - self.mouseX[todo]) ** 2 + (y - self.mouseY[todo]) ** 2) > MAXDISTANCE / SPAWN_DIVISOR
+            self.cheeseX[todo[farEnough]] = x[farEnough]
+            self.cheeseY[todo[farEnough]] = y[farEnough]
+            todo = todo[~farEnough]
+        if todo.size > 0:
+            raise ValueError('No cell is more than %.1f cells from (%d, %d)'
+                             % (MAXDISTANCE / SPAWN_DIVISOR, self.mouseX[todo[0]], self.mouseY[todo[0]]))
+
+    def lookup(self):
+        dx = self.cheeseX - self.mouseX + (CELLWIDTH - 1)
+        dy = self.cheeseY - self.mouseY + (CELLHEIGHT - 1)
+        self.distance = self.distanceTable[dx, dy]
+        self.volume = self.volumeTable[dx, dy]
+        self.leftGain = self.leftTable[dx, dy]
+        self.rightGain = self.rightTable[dx, dy]
+
+    def step(self):
+        # One game tick for everybody. Returns which mice ate their cheese.
+        startTime = time.perf_counter()
+
+        won = (self.mouseX == self.cheeseX) & (self.mouseY == self.cheeseY)
+        if won.any():
+            self.score += won
+            self.winSteps += numpy.where(won, self.stepsSinceWin, 0)
+            self.winStepsSq += numpy.where(won, self.stepsSinceWin ** 2, 0)
+            self.stepsSinceWin[won] = 0
+            self.timing[won] = False
+            self.respawn(won)
+
+        # Same order and clamps as GameEngine.step()
+        self.mouseX -= self.left & (self.mouseX > 0)
+        self.mouseX += self.right & (self.mouseX < CELLWIDTH - 1)
+        self.mouseY -= self.up & (self.mouseY > 0)
+        self.mouseY += self.down & (self.mouseY < CELLHEIGHT - 1)
+        self.lookup()
+
+        if won.any():
+            # Carry on with all keys let go
+            self.left[won] = self.right[won] = self.up[won] = self.down[won] = False
+
+        self.stepsSinceWin += self.timing
+        self.timing |= self.left | self.right | self.up | self.down
+        self.steps += 1
+        self.stepTime += time.perf_counter() - startTime
+        return won
+
+    def speak(self):
+        # The cues Temperature and Direction mode would give every mouse:
+        # temperature is 1 for hotter, -1 for colder, 0 for nothing, and
+        # direction indexes DIRECTIONCODES
+        temperature = numpy.sign(self.spokenDistance - self.distance).astype(numpy.int8)
+        direction = numpy.zeros(self.count, dtype=numpy.int8)
+        direction[self.mouseY > self.cheeseY] = 4
+        direction[self.mouseY < self.cheeseY] = 3
+        direction[self.mouseX > self.cheeseX] = 2
+        direction[self.mouseX < self.cheeseX] = 1
+        self.spokenDistance = self.distance.copy()
+        return temperature, direction
+
+    def report(self):
+        mouseSteps = self.steps * self.count
+        wins = int(self.score.sum())
+        lines = ['%d mice x %d steps: %.0f mouse-steps/s' % (self.count, self.steps,
+                                                             mouseSteps / max(self.stepTime, 1e-9))]
+        if wins > 0:
+            lines.append('%d cheeses eaten, %.1f steps (%.2f secs) each on average'
+                         % (wins, self.winSteps.sum() / float(wins), self.winSteps.sum() / float(wins) / GAME_FPS))
+        return '\n'.join(lines)
+
+# Everything that needs the time asks CLOCK, swap in a VirtualClock for batch runs
+CLOCK = MonotonicClock()
+
+# Start, pause and game over screens drop to IDLE_FPS (0 = stop drawing)
+# after IDLE_TIMEOUT seconds without input
+IDLE_TIMEOUT = 30.0
+IDLE_FPS = 1.0
+
+# sound stuff
+FREQ = 44100   # same as audio CD
+BITSIZE = -16  # signed 16 bit
+CHANNELS = 2   # 1 == mono, 2 == stereo
+BUFFER = 1024  # audio buffer size in no. of samples, the most we will use
+MIN_BUFFER = 128        # smallest buffer calibration will try
+CALIBRATE_SOUND = True  # look for the smallest buffer that plays on time
+CALIBRATE_SECONDS = 0.25
+
+# Every sound and font the game uses, loaded once by the AssetBank
+SOUND_FILES = {'won'    : 'Coin.ogg',
+               'hotter' : 'Hotter.wav',
+               'colder' : 'Colder.wav',
+               'left'   : 'Left.wav',
+               'right'  : 'Right.wav',
+               'up'     : 'Up.wav',
+               'down'   : 'Down.wav',
+               'nav'    : 'Continuous1min.ogg'}
+FONT_FILES = {'basic'    : ('freesansbold.ttf', 18),
+              'title'    : ('freesansbold.ttf', 100),
+              'gameOver' : ('freesansbold.ttf', 150)}
+
+# Looping sounds that would take more than this many bytes once decoded are
+# streamed from disk instead of held in memory
+SOUND_MEMORY_BUDGET = 4 * 1024 * 1024
+
+# Build the Sound mode tone in memory instead of decoding the 'nav' file.
+# Needs numpy, falls back to the file without it. The defaults match
+# Continuous1min.ogg: a steady 340 Hz sine.
+SYNTH_NAV_TONE = True
+NAV_TONE_FREQ = 340.0      # Hz
+NAV_TONE_WAVEFORM = 'sine' # 'sine', 'square', 'triangle' or 'sawtooth'
+NAV_TONE_AMPLITUDE = 0.8   # 0.0 - 1.0
+NAV_TONE_MOD_FREQ = 0.0    # Hz of tremolo, 0 = none
+NAV_TONE_MOD_DEPTH = 0.0   # 0.0 - 1.0
+NAV_TONE_SECONDS = 1.0     # rough length of the looped buffer
+
+# Most HUD text surfaces to keep around
+TEXT_CACHE_SIZE = 64
+
+# Most memory to spend on pre-rotated title screen frames. Both titles'
+# angles would take about 240 MB; the ones that don't fit are rotated every
+# frame. The frames are let go when the title screen ends.
+ROTATION_CACHE_BYTES = 32 * 1024 * 1024
+
+# Frames per second for drawing, 0 = the display's refresh rate. The game
+# itself still only steps at GAME_FPS.
+RENDER_FPS = 0.0
+
+# Set to True to spin on the clock like the old loop did (for comparing jitter)
+BUSY_WAIT = False
+
+# Keep each session's seed and keys in this folder so it can be replayed
+# with --replay. Empty = don't record.
+SESSION_DIR = 'sessions'
+
+# Log every game tick to a binary file in this folder, read it back with
+# --telemetry. Empty = don't log. The file grows TELEMETRY_CHUNK bytes at a time.
+TELEMETRY_DIR = 'sessions'
+TELEMETRY_CHUNK = 4 * 1024 * 1024
+
+# Telemetry is written by its own thread. The game drops records (and
+# counts them) rather than wait when more than TELEMETRY_QUEUE are waiting.
+# The thread writes once it has TELEMETRY_BATCH bytes or every
+# TELEMETRY_FLUSH_SECONDS. TELEMETRY_COMPRESS is 'zlib', 'lzma' or '' for
+# an uncompressed log that reads back without copying.
+TELEMETRY_QUEUE = 4096
+TELEMETRY_BATCH = 64 * 1024
+TELEMETRY_FLUSH_SECONDS = 2.0
+TELEMETRY_COMPRESS = ''
+
+# Every cheese eaten goes into this SQLite database, RESULTS_BATCH trials
+# (or one nav mode's run) at a time. Empty = don't keep results.
+RESULTS_DB = 'results.db'
+RESULTS_BATCH = 10
+
+
+class Timer:
+    # One repeating deadline plus how well we have been keeping it
+    def __init__(self, interval):
+        self.interval = interval
+        self.created = CLOCK.now()
+        self.nextDue = self.created + interval
+        self.active = True
+        self.ticks = 0
+        self.totalLateness = 0.0
+        self.maxLateness = 0.0
+        self.resyncs = 0
+        self.skips = 0
+
+
+class Scheduler:
+    # Keeps the next due time of each repeating timer and sleeps until the
+    # earliest one, waking early if an input event arrives.
+
+    def __init__(self):
+        self.timers = {}
+
+    def every(self, name, interval):
+        self.timers[name] = Timer(interval)
+
+    def setActive(self, name, active):
+        self.timers[name].active = active
+
+    def isDue(self, name):
+        return CLOCK.now() >= self.timers[name].nextDue
+
+    def due(self, name):
+        timer = self.timers[name]
+        now = CLOCK.now()
+        if now < timer.nextDue:
+            return False
+        lateness = now - timer.nextDue
+        if lateness >= timer.interval:
+            # Fell a whole interval behind (paused, mode switch, slow frame):
+            # start over from now rather than trying to catch up
+            timer.nextDue = now + timer.interval
+            timer.resyncs += 1
+        else:
+            timer.nextDue = timer.nextDue + timer.interval
+            timer.totalLateness += lateness
+            timer.maxLateness = max(timer.maxLateness, lateness)
+        timer.ticks += 1
+        return True
+
+    def skip(self, name):
+        # The tick came due but its work was dropped
+        self.timers[name].skips += 1
+
+    def wait(self):
+        if BUSY_WAIT:
+            return
+        deadlines = [timer.nextDue for timer in self.timers.values() if timer.active]
+        if CLOCK.virtual:
+            # Never sleep, just skip ahead to the next deadline. Queued input
+            # gets picked up on that tick. With nothing due (paused) only
+            # input can change anything, so wait for it.
+            INPUT.pump()
+            if len(deadlines) > 0:
+                CLOCK.advanceTo(min(deadlines))
+            elif len(INPUT.events) == 0:
+                INPUT.add(pygame.event.wait())
+            return
+        if len(deadlines) == 0:
+            INPUT.add(pygame.event.wait())
+        else:
+            timeout = int((min(deadlines) - CLOCK.now()) * 1000.0)
+            if timeout > 0:
+                INPUT.add(pygame.event.wait(timeout))
+        INPUT.pump()
+
+    def report(self):
+        lines = []
+        for name in sorted(self.timers):
+            timer = self.timers[name]
+            if timer.ticks == 0:
+                continue
+            elapsed = max(CLOCK.now() - timer.created, 1e-9)
+            onTime = timer.ticks - timer.resyncs
+            done = timer.ticks - timer.skips
+            lines.append('%s: %d ticks (%.1f/s) every %.1f ms, jitter avg %.2f ms max %.2f ms, %d resyncs, %d skipped'
+                         % (name, done, done / elapsed, timer.interval * 1000.0,
+                            timer.totalLateness / max(onTime, 1) * 1000.0,
+                            timer.maxLateness * 1000.0, timer.resyncs, timer.skips))
+        return '\n'.join(lines)
+
+
+class InputQueue:
+    # Key events stamped with the time we first saw them. The scheduler wakes
+    # up for every event, so the stamp is close to when the key went down.
+    # The game applies them in order on its next tick.
+
+    def __init__(self):
+        self.events = []
+
+    def start(self):
+        # Only let keys and quit into the SDL queue while playing
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed([KEYDOWN, KEYUP, QUIT])
+
+    def stop(self):
+        pygame.event.set_allowed(None)
+
+    def add(self, event):
+        if event.type != NOEVENT:
+            self.events.append((CLOCK.now(), event))
+
+    def pump(self):
+        now = CLOCK.now()
+        for event in pygame.event.get():
+            self.events.append((now, event))
+
+    def take(self):
+        self.pump()
+        events = self.events
+        self.events = []
+        return events
+
+
+class LatencyHistogram:
+    # Counts of how long things took, e.g. from a key press to the mouse moving.
+    # Each bucket is bucket seconds wide, and anything slower than buckets of
+    # them goes in the last one.
+
+    def __init__(self, title, bucket=0.005, buckets=20):
+        self.title = title
+        self.bucket = bucket
+        self.buckets = buckets
+        self.counts = [0] * (buckets + 1)
+        self.total = 0.0
+        self.worst = 0.0
+
+    def add(self, latency):
+        self.counts[min(int(latency / self.bucket), self.buckets)] += 1
+        self.total += latency
+        self.worst = max(self.worst, latency)
+
+    def report(self):
+        samples = sum(self.counts)
+        if samples == 0:
+            return ''
+        lines = ['%s: %d samples, avg %.1f ms, max %.1f ms'
+                 % (self.title, samples, self.total / samples * 1000.0, self.worst * 1000.0)]
+        width = max(3, len('%d' % (self.buckets * self.bucket * 1000)))
+        for i in range(self.buckets + 1):
+            if self.counts[i] == 0:
+                continue
+            if i == self.buckets:
+                label = '%*s ms' % (2 * width + 1, '>=%d' % round(i * self.bucket * 1000))
+            else:
+                label = '%*d-%*d ms' % (width, round(i * self.bucket * 1000), width, round((i + 1) * self.bucket * 1000))
+            lines.append('  %s: %5d %s' % (label, self.counts[i], '#' * min(self.counts[i], 50)))
+        return '\n'.join(lines)
 
+
+class AssetBank:
+    # Loads each sound and font once and hands out the same object every
+    # time. preload() decodes the sounds on a background thread while the
+    # title screen runs; anything asked for before it gets there is loaded
+    # right away. Fonts are always loaded on the main thread since SDL_ttf
+    # isn't thread safe.
+
+    def __init__(self):
+        self.assets = {}
+        self.loading = {}
+        self.stats = {} # name -> (load seconds, bytes)
+        self.errors = {} # name -> why its last load failed
+        self.lock = threading.Lock()
+
+    def preload(self):
+        thread = threading.Thread(target=self.loadSounds)
+        thread.daemon = True
+        thread.start()
+
+    def loadSounds(self):
+        # One bad file shouldn't stop the rest, the game reports it again
+        # when it asks for that sound
+        for name in sorted(SOUND_FILES):
+            try:
+                if not self.streams(name):
+                    self.get('sound:' + name)
+            except (pygame.error, EnvironmentError) as exc:
+                print('Could not preload sound %s: %s' % (name, exc), file=sys.stderr)
+
+    def sound(self, name):
+        return self.get('sound:' + name)
+
+    def loop(self, name, channel):
+        # Something to loop name with: streamed if it is over the memory
+        # budget, otherwise the shared Sound on the given channel
+        if self.streams(name):
+            return StreamSource(SOUND_FILES[name])
+        return ChannelSource(self.sound(name), channel)
+
+    def streams(self, name):
+        if name == 'nav' and SYNTH_NAV_TONE and numpy is not None:
+            return False
+        size = estimateDecodedBytes(SOUND_FILES[name])
+        return size is not None and size > SOUND_MEMORY_BUDGET
+
+    def font(self, name):
+        return self.get('font:' + name)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.assets:
+                return self.assets[key]
+            loader = self.loading.get(key)
+            if loader is None:
+                loader = self.loading[key] = threading.Event()
+                mine = True
+            else:
+                mine = False
+        if not mine:
+            # Someone else is loading it, wait for them
+            loader.wait()
+            with self.lock:
+                if key in self.assets:
+                    return self.assets[key]
+                raise self.errors[key]
+
+        try:
+            asset = self.load(key)
+        except BaseException as exc:
+            # Let the waiters see the error, and let a later get() try again
+            with self.lock:
+                del self.loading[key]
+                self.errors[key] = exc
+            loader.set()
+            raise
+        return asset
+
+    def load(self, key):
+        startTime = time.perf_counter()
+        kind, name = key.split(':')
+        if kind == 'sound':
+            if name == 'nav' and SYNTH_NAV_TONE and numpy is not None:
+                asset = makeNavTone()
+            else:
+                asset = pygame.mixer.Sound(SOUND_FILES[name])
+            frequency, sampleFormat, channels = pygame.mixer.get_init()
+            size = int(asset.get_length() * frequency) * channels * abs(sampleFormat) // 8
+        else:
+            fileName, pointSize = FONT_FILES[name]
+            asset = pygame.font.Font(fileName, pointSize)
+            fontPath = os.path.join(os.path.dirname(pygame.__file__), fileName)
+            if not os.path.exists(fontPath):
+                fontPath = fileName
+            size = os.path.getsize(fontPath) if os.path.exists(fontPath) else 0
+        with self.lock:
+            self.assets[key] = asset
+            self.stats[key] = (time.perf_counter() - startTime, size)
+            self.loading[key].set()
+        return asset
+
+    def report(self):
+        with self.lock:
+            stats = sorted(self.stats.items())
+        if len(stats) == 0:
+            return ''
+        lines = ['assets:']
+        for key, (loadTime, size) in stats:
+            lines.append('  %-16s %7.1f ms %9.1f KB' % (key, loadTime * 1000.0, size / 1024.0))
+        lines.append('  %-16s %7.1f ms %9.1f KB' % ('total', sum(stat[0] for key, stat in stats) * 1000.0,
+                                                     sum(stat[1] for key, stat in stats) / 1024.0))
+        return '\n'.join(lines)
+
+
+class ChannelSource:
+    # A Sound held in memory, looping on its own channel
+    def __init__(self, sound, channel):
+        self.sound = sound
+        self.channel = channel
+
+    def play(self):
+        self.sound.set_volume(1.0)
+        self.channel.play(self.sound, -1)
+
+    def setLevels(self, left, right):
+        self.channel.set_volume(left, right)
+
+    def stop(self):
+        self.channel.stop()
+
+
+class StreamSource:
+    # A long sound streamed from disk a chunk at a time by pygame.mixer.music,
+    # which loops without a gap. There is only one music stream and it has a
+    # single volume, so stereo levels get folded into the louder side.
+    def __init__(self, fileName):
+        self.fileName = fileName
+
+    def play(self):
+        pygame.mixer.music.load(self.fileName)
+        pygame.mixer.music.play(-1)
+
+    def setLevels(self, left, right):
+        pygame.mixer.music.set_volume(max(left, right))
+
+    def stop(self):
+        pygame.mixer.music.stop()
+
+
+def estimateDecodedBytes(fileName):
+    # How big fileName will be once decoded into the mixer's format, worked
+    # out from its headers without decoding it. None if we can't tell.
+    frequency, sampleFormat, channels = pygame.mixer.get_init()
+    try:
+        if fileName.lower().endswith('.wav'):
+            wavFile = wave.open(fileName, 'rb')
+            seconds = wavFile.getnframes() / float(wavFile.getframerate())
+            wavFile.close()
+        elif fileName.lower().endswith('.ogg'):
+            # The sample rate is in the vorbis id header at the start, and the
+            # last page's granule position is the total number of samples
+            with open(fileName, 'rb') as oggFile:
+                head = oggFile.read(4096)
+                idHeader = head.find(b'\x01vorbis')
+                if idHeader < 0:
+                    return None
+                rate = struct.unpack('<I', head[idHeader + 12:idHeader + 16])[0]
+                oggFile.seek(0, 2)
+                oggFile.seek(max(0, oggFile.tell() - 65536))
+                tail = oggFile.read()
+                lastPage = tail.rfind(b'OggS')
+                if lastPage < 0:
+                    return None
+                samples = struct.unpack('<q', tail[lastPage + 6:lastPage + 14])[0]
+            seconds = samples / float(rate)
+        else:
+            return None
+    except (IOError, EOFError, wave.Error, struct.error, ZeroDivisionError):
+        return None
+    return int(seconds * frequency) * channels * abs(sampleFormat) // 8
+
+
+def makeNavTone():
+    # A short buffer holding a whole number of tone and tremolo cycles, so
+    # it loops with no click. The frequencies get nudged slightly to fit.
+    frequency, sampleFormat, channels = pygame.mixer.get_init()
+    cycles = max(1, int(round(NAV_TONE_FREQ * NAV_TONE_SECONDS)))
+    samples = int(round(cycles * frequency / NAV_TONE_FREQ))
+    phase = numpy.arange(samples) * (float(cycles) / samples) % 1.0
+
+    if NAV_TONE_WAVEFORM == 'square':
+        tone = numpy.where(phase < 0.5, 1.0, -1.0)
+    elif NAV_TONE_WAVEFORM == 'triangle':
+        tone = 1.0 - 4.0 * numpy.abs(phase - 0.5)
+    elif NAV_TONE_WAVEFORM == 'sawtooth':
+        tone = 2.0 * phase - 1.0
+    else:
+        tone = numpy.sin(2.0 * math.pi * phase)
+
+    if NAV_TONE_MOD_FREQ > 0.0 and NAV_TONE_MOD_DEPTH > 0.0:
+        modCycles = max(1, int(round(NAV_TONE_MOD_FREQ * samples / float(frequency))))
+        modPhase = numpy.arange(samples) * (float(modCycles) / samples)
+        tone = tone * (1.0 - NAV_TONE_MOD_DEPTH * 0.5 * (1.0 - numpy.cos(2.0 * math.pi * modPhase)))
+
+    return makeSound(tone * NAV_TONE_AMPLITUDE)
+
+
+def makeSound(tone):
+    # Turn a mono wave of -1.0 to 1.0 floats into a Sound in the mixer's format
+    frequency, sampleFormat, channels = pygame.mixer.get_init()
+    if abs(sampleFormat) == 32:
+        # Asking for 32 gets a float mixer, which pygame reports as -32
+        samples = tone.astype(numpy.float32)
+    elif sampleFormat == -8:
+        samples = (tone * 127).astype(numpy.int8)
+    elif sampleFormat == 8:
+        samples = (tone * 127 + 128).astype(numpy.uint8)
+    elif sampleFormat == 16:
+        samples = (tone * 32767 + 32768).astype(numpy.uint16)
+    else:
+        samples = (tone * 32767).astype(numpy.int16)
+    if channels > 1:
+        samples = numpy.repeat(samples[:, numpy.newaxis], channels, axis=1)
+    return pygame.sndarray.make_sound(numpy.ascontiguousarray(samples))
+
+
+class TextCache:
+    # Rendered text surfaces, keyed on everything that changes what they look
+    # like. The least recently used ones are thrown out past maxSize.
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.surfs = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, color, antialias)
+        surf = self.surfs.get(key)
+        if surf is not None:
+            self.hits += 1
+            self.surfs.move_to_end(key)
+            return surf
+        self.misses += 1
+        surf = font.render(text, antialias, color)
+        self.surfs[key] = surf
+        if len(self.surfs) > self.maxSize:
+            self.surfs.popitem(last=False)
+        return surf
+
+    def report(self):
+        if self.hits + self.misses == 0:
+            return ''
+        return ('text cache: %d hits, %d misses (%.1f%% hit rate), %d surfaces'
+                % (self.hits, self.misses, self.hits * 100.0 / (self.hits + self.misses), len(self.surfs)))
+
+
+class RotationCache:
+    # Rotated copies of the title surfaces, made the first time each angle is
+    # shown and kept until clear(). Frames are cropped to what is drawn, so
+    # the see-through corners take no memory. Once maxBytes is used up,
+    # further angles are rotated on the fly instead of stored.
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.bytes = 0
+        self.peakBytes = 0
+        self.frames = {}
+        self.refused = set()
+        self.hits = 0
+        self.misses = 0
+
+    def rotate(self, name, surf, degrees, center):
+        # The rotated surface and the rect to blit it at, centred on center
+        key = (name, degrees % 360)
+        frame = self.frames.get(key)
+        if frame is not None:
+            self.hits += 1
+            rotated, offset = frame
+        else:
+            self.misses += 1
+            rotated = pygame.transform.rotate(surf, degrees % 360)
+            bounds = rotated.get_bounding_rect()
+            offset = (bounds.left - rotated.get_width() // 2, bounds.top - rotated.get_height() // 2)
+            if bounds.size != rotated.get_size():
+                rotated = rotated.subsurface(bounds).copy()
+            size = rotated.get_bytesize() * rotated.get_width() * rotated.get_height()
+            if self.bytes + size <= self.maxBytes:
+                self.frames[key] = (rotated, offset)
+                self.bytes += size
+                self.peakBytes = max(self.peakBytes, self.bytes)
+            else:
+                self.refused.add(key)
+        rect = rotated.get_rect()
+        rect.topleft = (int(center[0]) + offset[0], int(center[1]) + offset[1])
+        return rotated, rect
+
+    def clear(self):
+        # Let go of every frame
+        self.frames = {}
+        self.bytes = 0
+
+    def report(self):
+        if self.hits + self.misses == 0:
+            return ''
+        report = ('rotation cache: %d frames in %.1f MB (at most %.1f MB), %d hits, %d misses'
+                  % (len(self.frames), self.bytes / 1048576.0, self.peakBytes / 1048576.0, self.hits, self.misses))
+        if self.refused:
+            report += ('\n  full: %d angles did not fit in ROTATION_CACHE_BYTES and are rotated every time'
+                       % len(self.refused))
+        return report
+
+
+class Renderer:
+    # Keeps the background and grid in one cached surface, and only redraws
+    # and sends to the display the parts of the screen that changed.
+
+    def __init__(self):
+        self.background = pygame.Surface((WINDOWWIDTH, WINDOWHEIGHT)).convert()
+        self.background.fill(BGCOLOR)
+        drawGrid(self.background)
+        self.mouseSurf = pygame.Surface((CELLSIZE, CELLSIZE)).convert()
+        drawMouse(self.mouseSurf, 0, 0)
+        self.cheeseSurf = pygame.Surface((CELLSIZE, CELLSIZE)).convert()
+        drawCheese(self.cheeseSurf, 0, 0)
+        self.onScreen = None # (layer, content, rect) of everything drawn last frame
+        self.frames = 0
+        self.drawnFrames = 0
+        self.pixels = 0
+
+    def invalidate(self):
+        # Something else drew on the screen, start from scratch next frame
+        self.onScreen = None
+
+    def draw(self, mousePos, cheese, scoreLines):
+        # Layers from the bottom up: cheese, mouse, HUD text
+        items = [('cheese', None, (cheese[0] * CELLSIZE, cheese[1] * CELLSIZE, CELLSIZE, CELLSIZE)),
+                 ('mouse', None, (mousePos[0], mousePos[1], CELLSIZE, CELLSIZE))]
+        for text, topleft in scoreLines:
+            items.append(('text', text, topleft + BASICFONT.size(text)))
+        self.frames += 1
+
+        if self.onScreen is None:
+            dirty = [DISPLAYSURF.get_rect()]
+        else:
+            changed = set(items).symmetric_difference(self.onScreen)
+            dirty = [pygame.Rect(rect) for layer, content, rect in changed]
+        self.onScreen = items
+        if len(dirty) == 0:
+            return
+
+        # Anything overlapping a dirty area gets redrawn whole, so its full
+        # rect has to be restored (and may drag in more items above it)
+        redraw = []
+        growing = True
+        while growing:
+            growing = False
+            for item in items:
+                rect = pygame.Rect(item[2])
+                if item not in redraw and rect.collidelist(dirty) != -1:
+                    redraw.append(item)
+                    if not any(area.contains(rect) for area in dirty):
+                        dirty.append(rect)
+                    growing = True
+
+        for rect in dirty:
+            DISPLAYSURF.blit(self.background, rect, rect)
+        for item in items:
+            layer, content, rect = item
+            if item not in redraw:
+                continue
+            if layer == 'cheese':
+                DISPLAYSURF.blit(self.cheeseSurf, rect)
+            elif layer == 'mouse':
+                DISPLAYSURF.blit(self.mouseSurf, rect)
+            else:
+                DISPLAYSURF.blit(TEXTCACHE.render(BASICFONT, content, WHITE), rect)
+        pygame.display.update(dirty)
+
+        self.drawnFrames += 1
+        for rect in dirty:
+            self.pixels += rect.width * rect.height
+
+    def report(self):
+        if self.drawnFrames == 0:
+            return ''
+        perFrame = self.pixels / float(self.frames)
+        return ('renderer: %d frames, %d drawn, %d pixels redrawn per frame (%.2f%% of the screen)'
+                % (self.frames, self.drawnFrames, perFrame, perFrame * 100.0 / (WINDOWWIDTH * WINDOWHEIGHT)))
+
+
+class CueDispatcher:
+    # Plays spoken cues and the win sound one at a time on a reserved
+    # channel. A cue waits while something else is playing, a higher priority
+    # one cuts it off, and a waiting cue is dropped if isCurrent() says the
+    # game has moved on and it no longer describes what is going on.
+    LAG_BUCKET = 0.05 # a cue can wait out a whole spoken word, so its lag
+    LAG_BUCKETS = 40  # histogram goes up to 2 seconds
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.pending = None  # (sound, priority, isCurrent, decided at)
+        self.playingPriority = 0
+        self.lag = LatencyHistogram('cue lag', self.LAG_BUCKET, self.LAG_BUCKETS)
+        self.played = 0
+        self.stale = 0
+        self.replaced = 0
+
+    def request(self, sound, priority, isCurrent=None):
+        if self.pending is not None:
+            if self.pending[1] > priority:
+                return
+            self.replaced += 1
+        self.pending = (sound, priority, isCurrent, CLOCK.now())
+        self.update()
+
+    def update(self):
+        if self.pending is None:
+            return
+        sound, priority, isCurrent, decided = self.pending
+        if isCurrent is not None and not isCurrent():
+            self.pending = None
+            self.stale += 1
+            return
+        if self.channel.get_busy() and priority <= self.playingPriority:
+            return
+        self.channel.play(sound)
+        self.playingPriority = priority
+        self.pending = None
+        self.played += 1
+        self.lag.add(CLOCK.now() - decided)
+
+    def report(self):
+        if self.played + self.stale == 0:
+            return ''
+        return ('cues: %d played, %d dropped as stale, %d replaced\n%s'
+                % (self.played, self.stale, self.replaced, self.lag.report()))
+
+
+def getRefreshRate():
+    # Frames per second for the render pass: RENDER_FPS, or the display's own
+    # refresh rate when that is 0
+    if RENDER_FPS > 0:
+        return RENDER_FPS
+    try:
+        rate = pygame.display.get_current_refresh_rate()
+    except (AttributeError, pygame.error):
+        rate = 0
+    if rate <= 0:
+        rate = 60
+    return float(rate)
+
+
+def main(seed=None, participant='anonymous'):
+    global DISPLAYSURF, BASICFONT, SCHEDULER, LASTINPUTTIME, INPUT, KEYLATENCY, RENDERER, TEXTCACHE, ROTATIONS, ASSETS, CUES, SEED, PARTICIPANT
+
+    # Every session gets its own seed so it can be replayed
+    if seed is None:
+        seed = random.SystemRandom().randrange(2 ** 32)
+    SEED = seed
+    PARTICIPANT = participant
+
+    pygame.mixer.pre_init(FREQ, BITSIZE, CHANNELS, BUFFER)
     pygame.init()    
-    FPSCLOCK = pygame.time.Clock()
+    initSound()
+    pygame.mixer.set_reserved(2)
+    SCHEDULER = Scheduler()
+    INPUT = InputQueue()
+    KEYLATENCY = LatencyHistogram('key to move latency')
+    LASTINPUTTIME = CLOCK.now()
     DISPLAYSURF = pygame.display.set_mode((WINDOWWIDTH, WINDOWHEIGHT))
-    BASICFONT = pygame.font.Font('freesansbold.ttf', 18)
+    ASSETS = AssetBank()
+    ASSETS.preload()
+    CUES = CueDispatcher(pygame.mixer.Channel(CUECHANNEL))
+    BASICFONT = ASSETS.font('basic')
     pygame.display.set_caption(TITLE)
+    TEXTCACHE = TextCache(TEXT_CACHE_SIZE)
+    ROTATIONS = RotationCache(ROTATION_CACHE_BYTES)
+    RENDERER = Renderer()
     showStartScreen()
+    # The title screen is only shown once, so its frames are no more use
+    ROTATIONS.clear()
  
     while True:
         runGame()
@@ -57,188 +1883,155 @@ def main():
 def runGame():
     
     # Initialize game stuff.
-    score = 0
-    justWon = True
-    pauseGame = False
-
     wonVolume = 0.2
-    wonSound = pygame.mixer.Sound('Coin.ogg')
+    wonSound = ASSETS.sound('won')
     wonSound.set_volume (wonVolume)
 
     spokenVolume = 0.3
-    hotterSound = pygame.mixer.Sound('Hotter.wav')
-    hotterSound.set_volume(spokenVolume)
-    colderSound = pygame.mixer.Sound('Colder.wav')
-    colderSound.set_volume(spokenVolume)
-    leftSound = pygame.mixer.Sound('Left.wav')
-    leftSound.set_volume(spokenVolume)
-    rightSound = pygame.mixer.Sound('Right.wav')
-    rightSound.set_volume(spokenVolume)
-    upSound = pygame.mixer.Sound('Up.wav')
-    upSound.set_volume(spokenVolume)
-    downSound = pygame.mixer.Sound('Down.wav')
-    downSound.set_volume(spokenVolume)
-
-    navMode = NavMode.Sound
-    navSound = pygame.mixer.Sound('Continuous1min.ogg')
-    if navMode == NavMode.Sound:
-        navVolumeLevel = 0.1
-    else:
-        navVolumeLevel = 0.0
-    navSound.set_volume(navVolumeLevel)
-    navSound.play(-1)
-
-    gameTimer = speakTimer = winTimer = time.time()
-    averageWinTime = -2.0
-    keyState = {LEFT : False, RIGHT : False, UP : False, DOWN : False}
+    cueSounds = {}
+    for name in (HOTTER, COLDER, LEFT, RIGHT, UP, DOWN):
+        cueSounds[name] = ASSETS.sound(name)
+        cueSounds[name].set_volume(spokenVolume)
 
-    # Set a random start point for the mouse somewhere near the center.
-    startx = random.randint(5, CELLWIDTH - 6)
-    starty = random.randint(5, CELLHEIGHT - 6)
-    mouseCoord = {'x': startx,'y': starty}
+    SCHEDULER.every('game', 1.0 / GAME_FPS)
+    SCHEDULER.every('speak', 1.0 / SPEAK_FPS)
+    SCHEDULER.every('render', 1.0 / getRefreshRate())
+    INPUT.start()
+    RENDERER.invalidate()
+    pressTime = None
+    stepTime = CLOCK.now()
 
-    # Set the cheese in a random place.
-    cheese = getRandomLocation(mouseCoord)
+    # All the rules live in the engine, this loop just feeds it keys and
+    # time (through the session recorder) and turns what it does into sound
+    # and pictures
+    global TRIALS, SESSION, TELEMETRY, RESULTS, STATS, HEATMAPS
+    SESSION = SessionRecorder(SEED, CLOCK.now())
+    engine = SESSION.engine
+    TRIALS = TrialRecorder(engine)
+    STATS = WinTimeStats()
+    if numpy is not None:
+        HEATMAPS = VisitHeatmaps()
+    if TELEMETRY_DIR:
+        if not os.path.isdir(TELEMETRY_DIR):
+            os.makedirs(TELEMETRY_DIR)
+        TELEMETRY = TelemetryWriter(os.path.join(TELEMETRY_DIR, SESSION.name + '.telemetry'))
+    if RESULTS_DB:
+        RESULTS = ResultsStore(RESULTS_DB, PARTICIPANT, SESSION.name)
+    tickCue = None
 
-    # Find the distance between the mouse and the cheese.
-    distance = math.sqrt ((mouseCoord['x'] - cheese['x']) ** 2 + (mouseCoord['y'] - cheese['y']) ** 2)
-    prevDistance = distance
+    # The nav tone plays at full volume and its loudness is all set through
+    # the source, so stereo modes can set each side
+    navSource = ASSETS.loop('nav', pygame.mixer.Channel(NAVCHANNEL))
+    navSource.play()
+    navLevels = engine.levels
+    navSource.setLevels(*navLevels)
 
     while True: # The main game loop
 
-        if pauseGame:
-            for event in pygame.event.get():
+        # Sleep until the next timer is due or a key is pressed
+        SCHEDULER.setActive('game', engine.paused == False)
+        SCHEDULER.setActive('speak', (engine.paused == False) and (engine.navMode not in NAVTONEMODES))
+        SCHEDULER.setActive('render', engine.paused == False)
+        SCHEDULER.wait()
+        CUES.update()
+
+        if engine.paused:
+            for eventTime, event in INPUT.take():
                 if event.type == KEYDOWN:
                     if event.key == K_SPACE:
-                        pauseGame = False
-                        keyState = {LEFT : False, RIGHT : False, UP : False, DOWN : False}
-                        if navMode == NavMode.Sound:
-                             navSound.set_volume (0.1)
+                        SESSION.resume()
                     elif (event.key == K_ESCAPE):
                         terminate()                             
         
-        # Provide spoken directions no faster than SPEAK_FPS
-        if (pauseGame == False) and (navMode != NavMode.Sound) and (time.time() - speakTimer >= 1.0 / SPEAK_FPS):
-            speakTimer = time.time()
-            
-            if navMode == NavMode.Temperature:
-                if prevDistance > distance:
-                    # Getting closer to cheese.
-                    hotterSound.play ()
-                elif prevDistance < distance:
-                    # Getting farther from the cheese.
-                    colderSound.play ()
-                    
-            elif navMode == NavMode.Direction:
-
-                if mouseCoord['x'] < cheese ['x']:
-                    rightSound.play ()
-                elif mouseCoord ['x'] > cheese ['x']:
-                    leftSound.play ()
-                elif mouseCoord['y'] < cheese ['y']:
-                    downSound.play ()
-                elif mouseCoord ['y'] > cheese ['y']:
-                    upSound.play ()
-                
-            prevDistance = distance 
+        # Provide spoken directions no faster than SPEAK_FPS. Each cue only
+        # stays wanted while what it says is still true.
+        if (engine.paused == False) and (engine.navMode not in NAVTONEMODES) and SCHEDULER.due('speak'):
+            fromDistance = engine.spokenDistance
+            cue = SESSION.speak()
+            if cue is not None:
+                tickCue = cue
+                CUES.request(cueSounds[cue], CUE_NAV,
+                             lambda cue=cue, fromDistance=fromDistance: engine.cueHolds(cue, fromDistance))
                 
-        # Process input and update display no faster than GAME_FPS
-        if (pauseGame == False) and (time.time() - gameTimer >= 1.0 / GAME_FPS):
-            gameTimer = time.time()
+        # Process input and step the game at exactly GAME_FPS
+        if (engine.paused == False) and SCHEDULER.due('game'):
+            stepTime = CLOCK.now()
+            SESSION.time(stepTime)
             
             # Process all user input events.
-            for event in pygame.event.get():           
+            for eventTime, event in INPUT.take():
                 if event.type == KEYDOWN or event.type == KEYUP:
-                    keyDown = (event.type == KEYDOWN)
-
-                    # Don't reset the timer until they've pressed the
-                    # first key after winning
-                    if justWon and event.key != K_SPACE:
-                        justWon = False
-                        winTimer = time.time()
-                        
-                    if (event.key == K_LEFT or event.key == K_a):
-                        keyState[LEFT] = keyDown              
-                    elif (event.key == K_RIGHT or event.key == K_d):
-                        keyState[RIGHT] = keyDown
-                    elif (event.key == K_UP or event.key == K_w):
-                        keyState[UP] = keyDown
-                    elif (event.key == K_DOWN or event.key == K_s):
-                        keyState[DOWN] = keyDown
-                    elif (event.key == K_n and keyDown):
-                        averageWinTime = -2.0
-                        navMode = (navMode + 1) % NAVMODES
-                        if navMode != NavMode.Sound:
-                            navSound.set_volume(0.0)
-                        else:
-                            navSound.set_volume(0.1)
-                    elif (event.key == K_ESCAPE):
+                    if (event.key == K_ESCAPE):
                         terminate()
+                    keyDown = (event.type == KEYDOWN)
+                    if keyDown and pressTime is None and event.key in MOVEKEYS:
+                        pressTime = eventTime
+                    SESSION.press(KEYMAP.get(event.key, OTHERKEY), keyDown)
                 elif event.type == QUIT:
                     terminate()
-          
-            # Did the mouse eat the cheese?
-            if mouseCoord['x'] == cheese['x'] and mouseCoord['y'] == cheese['y']:
-                
-                # Get the winning time and compute the running average win time
-                # Throw out the initial win time 
-                if averageWinTime <= -2.0:
-                    averageWinTime = -1.0
-                elif averageWinTime <= -1.0:
-                    averageWinTime = winTime
-                else:
-                    averageWinTime = (averageWinTime + winTime) / 2.0
-
-                # Flag as just won so timer doesn't start again until key press
-                justWon = True
-
-                # Play winning sound and update the score
-                wonSound.play()
-                score = score + 1
-
-                # Move the cheese
-                cheese = getRandomLocation(mouseCoord)
-
-                # Pause game and turn off sound if it was playing
-                pauseGame = True
-                if navMode == NavMode.Sound:
-                     navSound.set_volume (0.0)
-
-            # Move the mouse by updating its position based on the key state.
-            if keyState[LEFT] and mouseCoord [ 'x' ] > 0:
-                mouseCoord['x'] = mouseCoord['x'] - 1
-            if keyState[RIGHT] and mouseCoord [ 'x' ] < CELLWIDTH - 1:
-                mouseCoord['x'] = mouseCoord['x'] + 1
-            if keyState[UP] and mouseCoord [ 'y' ] > 0:
-                mouseCoord['y'] = mouseCoord['y'] - 1
-            if keyState[DOWN] and mouseCoord[ 'y' ] < CELLHEIGHT - 1:
-                mouseCoord['y'] = mouseCoord['y'] + 1
-    
-            # Find the distance between the mouse and the cheese.
-            distance = math.sqrt ((mouseCoord['x'] - cheese['x']) ** 2 + (mouseCoord['y'] - cheese['y']) ** 2)
-
-            if navMode == NavMode.Sound:
-                # Determine the volume level based on inverse distance squared
-                newVolumeLevel = 1.0 / ((distance / MAXDISTANCE * 6.0 + 1.0) ** 2.0)
-                if newVolumeLevel != navVolumeLevel:
-                    navVolumeLevel = newVolumeLevel
-                    navSound.set_volume (navVolumeLevel)
+
+            won = SESSION.step()
+            TRIALS.step(won)
+            if won:
+                # Play winning sound
+                CUES.request(wonSound, CUE_WIN)
+                tickCue = 'won'
+                STATS.add(PARTICIPANT, TRIALS.trials[-1])
+                if RESULTS_DB:
+                    RESULTS.add(TRIALS.trials[-1])
+                # Keep the session on disk in case the game never gets to
+                # terminate()
+                saveSession()
+            if TELEMETRY_DIR:
+                TELEMETRY.add(engine, SESSION.micros / 1000000.0, tickCue, won)
+            if numpy is not None and not engine.paused:
+                HEATMAPS.visit(engine)
+            tickCue = None
     
-            # Draw everything
-            DISPLAYSURF.fill(BGCOLOR)
-            drawGrid()
-            drawMouse(mouseCoord)
-            drawCheese(cheese)
-            if justWon:
-                winTime = 0.0
+            # How long did the press take to move the mouse?
+            if pressTime is not None:
+                if (engine.mouseX, engine.mouseY) != (engine.prevX, engine.prevY):
+                    KEYLATENCY.add(stepTime - pressTime)
+                    pressTime = None
+                elif not engine.moving():
+                    pressTime = None
+
+            if engine.paused:
+                # Show where the mouse ended up, nothing is drawn while paused
+                mouse = (engine.mouseX, engine.mouseY)
+                drawGame(mouse, mouse, 1.0, (engine.cheeseX, engine.cheeseY), engine.score,
+                         engine.distance, engine.winTime, engine.practice,
+                         STATS.get(PARTICIPANT, engine.navMode), engine.navMode)
+
+        if engine.levels != navLevels:
+            navLevels = engine.levels
+            navSource.setLevels(*navLevels)
+
+        # Draw at the display's rate, sliding the mouse between cells. If the
+        # game is due to step, skip this frame rather than make it wait.
+        if (engine.paused == False) and SCHEDULER.due('render'):
+            if SCHEDULER.isDue('game'):
+                SCHEDULER.skip('render')
+                continue
+            alpha = min(1.0, (CLOCK.now() - stepTime) * GAME_FPS)
+            if engine.justWon:
+                shownTime = 0.0
             else:
-                winTime = time.time() - winTimer
-            drawScore(score, distance, winTime, averageWinTime, navMode, pauseGame)
-            pygame.display.update()
+                shownTime = CLOCK.now() - SESSION.start - engine.winTimer
+            drawGame((engine.prevX, engine.prevY), (engine.mouseX, engine.mouseY), alpha,
+                     (engine.cheeseX, engine.cheeseY), engine.score, engine.distance, shownTime,
+                     engine.practice, STATS.get(PARTICIPANT, engine.navMode), engine.navMode)
+
+
+def drawGame(prevMouseCoord, mouseCoord, alpha, cheese, score, distance, winTime, practice, stats, navMode):
+    # Draw everything, with the mouse alpha of the way from its last cell to its new one
+    mouseX = int(round((prevMouseCoord[0] + (mouseCoord[0] - prevMouseCoord[0]) * alpha) * CELLSIZE))
+    mouseY = int(round((prevMouseCoord[1] + (mouseCoord[1] - prevMouseCoord[1]) * alpha) * CELLSIZE))
+    RENDERER.draw((mouseX, mouseY), cheese, getScoreLines(score, distance, winTime, practice, stats, navMode))
 
 
 def drawPressKeyMsg():
-    pressKeySurf = BASICFONT.render('Press a key to play.', True, DARKGRAY)
+    pressKeySurf = TEXTCACHE.render(BASICFONT, 'Press a key to play.', DARKGRAY)
     pressKeyRect = pressKeySurf.get_rect()
     pressKeyRect.topleft = (WINDOWWIDTH - 200, WINDOWHEIGHT - 30)
     DISPLAYSURF.blit(pressKeySurf, pressKeyRect)
@@ -256,51 +2049,194 @@ def checkForKeyPress():
     return keyUpEvents[0].key
 
 
+def waitForKeyPress(deadline=None):
+    # Sleep until a key is released (returns the key), other input arrives or
+    # the deadline passes (returns None). With no deadline, waits forever.
+    global LASTINPUTTIME
+    if deadline is None:
+        event = pygame.event.wait()
+    elif CLOCK.virtual:
+        # Take whatever input is waiting, else jump to the deadline
+        event = pygame.event.poll()
+        if event.type == NOEVENT:
+            CLOCK.advanceTo(deadline)
+            return None
+    else:
+        timeout = int((deadline - CLOCK.now()) * 1000)
+        if timeout <= 0:
+            return None
+        event = pygame.event.wait(timeout)
+
+    if event.type == QUIT:
+        terminate()
+    if event.type in (KEYDOWN, KEYUP, MOUSEMOTION, MOUSEBUTTONDOWN):
+        LASTINPUTTIME = CLOCK.now()
+    if event.type == KEYUP:
+        if event.key == K_ESCAPE:
+            terminate()
+        return event.key
+    return None
+
+
 def showStartScreen():
-    titleFont = pygame.font.Font('freesansbold.ttf', 100)
+    titleFont = ASSETS.font('title')
     titleSurf1 = titleFont.render(TITLE, True, GRAY, BLUE)
     titleSurf2 = titleFont.render(TITLE, True, DARKYELLOW)
 
     degrees1 = 0
     degrees2 = 0
+    nextFrame = CLOCK.now()
     while True:
+        if nextFrame is None:
+            # Woken up from idle by some input
+            nextFrame = CLOCK.now()
+        if CLOCK.now() < nextFrame:
+            if waitForKeyPress(nextFrame) is not None:
+                pygame.event.get() # clear event queue
+                return
+            continue
+
+        # Slow down (or stop) the animation when nobody is around
+        if CLOCK.now() - LASTINPUTTIME >= IDLE_TIMEOUT:
+            fps = IDLE_FPS
+        else:
+            fps = TITLE_FPS
+        if fps <= 0:
+            nextFrame = None
+            if waitForKeyPress() is not None:
+                pygame.event.get() # clear event queue
+                return
+            continue
+        nextFrame = CLOCK.now() + 1.0 / fps
+
         DISPLAYSURF.fill(BGCOLOR)
-        rotatedSurf1 = pygame.transform.rotate(titleSurf1, degrees1)
-        rotatedRect1 = rotatedSurf1.get_rect()
-        rotatedRect1.center = (WINDOWWIDTH / 2, WINDOWHEIGHT / 2)
+        center = (WINDOWWIDTH / 2, WINDOWHEIGHT / 2)
+        rotatedSurf1, rotatedRect1 = ROTATIONS.rotate('title1', titleSurf1, degrees1, center)
         DISPLAYSURF.blit(rotatedSurf1, rotatedRect1)
 
-        rotatedSurf2 = pygame.transform.rotate(titleSurf2, degrees2)
-        rotatedRect2 = rotatedSurf2.get_rect()
-        rotatedRect2.center = (WINDOWWIDTH / 2, WINDOWHEIGHT / 2)
+        rotatedSurf2, rotatedRect2 = ROTATIONS.rotate('title2', titleSurf2, degrees2, center)
         DISPLAYSURF.blit(rotatedSurf2, rotatedRect2)
 
         drawPressKeyMsg()
 
-        if checkForKeyPress():
-            pygame.event.get() # clear event queue
-            return
         pygame.display.update()
-        FPSCLOCK.tick(TITLE_FPS)
         degrees1 += 3 # rotate by 3 degrees each frame
         degrees2 += 7 # rotate by 7 degrees each frame
 
 
+def initSound():
+    # Start the mixer with the sound constants. With CALIBRATE_SOUND, keep
+    # halving the buffer while a test sound still plays in real time (if the
+    # mixer can't keep up it underruns and playback stretches out) and use
+    # the smallest one that kept up.
+    # If these settings do not work with your audio system change the
+    # global constants accordingly.
+    try:
+        if pygame.mixer.get_init() is None:
+            pygame.mixer.init(FREQ, BITSIZE, CHANNELS, BUFFER)
+        buffer = BUFFER
+        if CALIBRATE_SOUND:
+            while buffer // 2 >= MIN_BUFFER and soundKeepsUp(buffer // 2):
+                buffer = buffer // 2
+            pygame.mixer.quit()
+            pygame.mixer.init(FREQ, BITSIZE, CHANNELS, buffer)
+    except pygame.error as exc:
+        print("Could not initialize sound system: %s" % exc, file=sys.stderr)
+        return 1
+
+    frequency, sampleFormat, channels = pygame.mixer.get_init()
+    # Roughly two buffers sit between a play() call and the speaker
+    print("sound: %d Hz, %d bit, %d channels, %d sample buffer, about %.1f ms output latency"
+          % (frequency, sampleFormat, channels, buffer, 2000.0 * buffer / frequency), file=sys.stderr)
+
+
+def soundKeepsUp(buffer):
+    # Play CALIBRATE_SECONDS of silence with this buffer size and see if it
+    # finishes on time. A buffer the mixer won't even start with doesn't
+    # keep up either; initSound() starts it again at the last good size.
+    try:
+        pygame.mixer.quit()
+        pygame.mixer.init(FREQ, BITSIZE, CHANNELS, buffer)
+        frequency, sampleFormat, channels = pygame.mixer.get_init()
+        samples = int(frequency * CALIBRATE_SECONDS)
+        silence = pygame.mixer.Sound(buffer=bytes(samples * channels * (abs(sampleFormat) // 8)))
+
+        startTime = time.perf_counter()
+        silence.play()
+        while pygame.mixer.get_busy():
+            pygame.time.wait(5)
+        elapsed = time.perf_counter() - startTime
+    except pygame.error:
+        return False
+
+    # Allow for a couple of buffers of start up delay plus 10%
+    allowed = CALIBRATE_SECONDS * 1.1 + 3.0 * buffer / frequency
+    return elapsed <= allowed
+
+
 def terminate():
+    if 'SCHEDULER' in globals():
+        for report in (SCHEDULER.report(), KEYLATENCY.report(), RENDERER.report(),
+                       TEXTCACHE.report(), ROTATIONS.report(), ASSETS.report(), CUES.report()):
+            if report:
+                print(report, file=sys.stderr)
+    if 'RESULTS' in globals():
+        RESULTS.close()
+    if 'TELEMETRY' in globals():
+        TELEMETRY.close()
+        report = TELEMETRY.report()
+        if report:
+            print(report, file=sys.stderr)
+    path = saveSession()
+    if path is not None:
+        print('session saved to %s' % path, file=sys.stderr)
+    if 'STATS' in globals() and STATS.stats:
+        print(STATS.report(), file=sys.stderr)
     pygame.quit()
     sys.exit()
 
 
-def getRandomLocation(avoidCoord):
-    # Return a random location not too close to avoidCoord
-    while True:
-        randomCoord = {'x': random.randint(0, CELLWIDTH - 1), 'y': random.randint(0, CELLHEIGHT - 1)}
-        distance = math.sqrt ((randomCoord['x'] - avoidCoord['x']) ** 2 + (randomCoord['y'] - avoidCoord['y']) ** 2)
-        if distance > MAXDISTANCE / 3.0:
+def saveSession():
+    # Write the session so far, with its stats and heatmaps, to SESSION_DIR.
+    # Returns where the session went, or None if there is none to save.
+    if 'SESSION' not in globals() or not SESSION_DIR:
+        return None
+    if not os.path.isdir(SESSION_DIR):
+        os.makedirs(SESSION_DIR)
+    path = os.path.join(SESSION_DIR, SESSION.name + '.session')
+    SESSION.save(path, TRIALS.trials)
+    if STATS.stats:
+        STATS.export(os.path.join(SESSION_DIR, SESSION.name + '.stats.json'))
+    if 'HEATMAPS' in globals():
+        HEATMAPS.save(os.path.join(SESSION_DIR, SESSION.name + '.heatmap.npz'))
+    return path
+
+
+def getDirectionCue(mouseX, mouseY, cheeseX, cheeseY):
+    # Which way to go: sideways first, then up or down
+    if mouseX < cheeseX:
+        return RIGHT
+    elif mouseX > cheeseX:
+        return LEFT
+    elif mouseY < cheeseY:
+        return DOWN
+    elif mouseY > cheeseY:
+        return UP
+    return None
+
+
+def getRandomLocation(avoidCoord, rng=random):
+    # Return a random (x, y) location not too close to avoidCoord
+    for attempt in range(SPAWN_TRIES):
+        randomCoord = (rng.randint(0, CELLWIDTH - 1), rng.randint(0, CELLHEIGHT - 1))
+        distance = math.sqrt ((randomCoord[0] - avoidCoord[0]) ** 2 + (randomCoord[1] - avoidCoord[1]) ** 2)
+        if distance > MAXDISTANCE / SPAWN_DIVISOR:
             return randomCoord
+    raise ValueError('No cell is more than %.1f cells from %s' % (MAXDISTANCE / SPAWN_DIVISOR, avoidCoord))
 
 def showGameOverScreen():
-    gameOverFont = pygame.font.Font('freesansbold.ttf', 150)
+    INPUT.stop()
+    gameOverFont = ASSETS.font('gameOver')
     gameSurf = gameOverFont.render('Game', True, WHITE)
     overSurf = gameOverFont.render('Over', True, WHITE)
     gameRect = gameSurf.get_rect()
@@ -315,73 +2251,580 @@ def showGameOverScreen():
     pygame.time.wait(500)
     checkForKeyPress() # clear out any key presses in the event queue
 
-    while True:
-        if checkForKeyPress():
-            pygame.event.get() # clear event queue
-            return
+    # Nothing moves on this screen, so just sleep until a key is pressed
+    while waitForKeyPress() is None:
+        pass
+    pygame.event.get() # clear event queue
 
 
-def drawScore(score, distance, winTime, avgTime, navMode, pauseGame):
-    scoreSurf = BASICFONT.render('Score: %s' % (score), True, WHITE)
-    scoreRect = scoreSurf.get_rect()
-    scoreRect.topleft = (WINDOWWIDTH - 160, 10)
-    DISPLAYSURF.blit(scoreSurf, scoreRect)
-    
-    distSurf = BASICFONT.render('Distance: %s' % round(distance,1), True, WHITE)
-    distRect = distSurf.get_rect()
-    distRect.topleft = (WINDOWWIDTH - 160, 30)
-    DISPLAYSURF.blit(distSurf, distRect)
-
-    navModeStrings = [ 'Sound', 'Temperature', 'Direction', 'Sound & Direction' ]
-    navSurf = BASICFONT.render('Navigation: %s' % navModeStrings[navMode], True, WHITE)
-    navRect = navSurf.get_rect()
-    navRect.topleft = (10, 10)
-    DISPLAYSURF.blit(navSurf, navRect)
-    
-    timeSurf = BASICFONT.render('Time: %s secs' % round(winTime,1), True, WHITE)
-    timeRect = timeSurf.get_rect()
-    timeRect.topleft = (10, 30)
-    DISPLAYSURF.blit(timeSurf, timeRect)
-
-    if avgTime >= 0.0:
-       avgTimeSurf = BASICFONT.render('Average time: %s secs' % round(avgTime, 1), True, WHITE)
-       avgTimeRect = avgTimeSurf.get_rect()
-       avgTimeRect.topleft = (10, 50)
-       DISPLAYSURF.blit(avgTimeSurf, avgTimeRect)
-    elif avgTime == -1.0:
-       avgTimeSurf = BASICFONT.render('Average time: %s secs' % round(winTime,1), True, WHITE)
-       avgTimeRect = avgTimeSurf.get_rect()
-       avgTimeRect.topleft = (10, 50)
-       DISPLAYSURF.blit(avgTimeSurf, avgTimeRect)
-    elif avgTime == -2.0:
-       avgTimeSurf = BASICFONT.render('***PRACTICE RUN***', True, WHITE)
-       avgTimeRect = avgTimeSurf.get_rect()
-       avgTimeRect.topleft = (10, 50)
-       DISPLAYSURF.blit(avgTimeSurf, avgTimeRect)        
-
-
-def drawMouse(mouseCoord):
-    x = mouseCoord['x'] * CELLSIZE
-    y = mouseCoord['y'] * CELLSIZE
+def getScoreLines(score, distance, winTime, practice, stats, navMode):
+    # The HUD as a list of (text, topleft) lines. stats is the RunningStats
+    # of win times in this mode, None before there are any.
+    lines = [('Score: %s' % (score), (WINDOWWIDTH - 160, 10)),
+             ('Distance: %s' % round(distance,1), (WINDOWWIDTH - 160, 30)),
+             ('Navigation: %s' % NAVMODENAMES[navMode], (10, 10)),
+             ('Time: %s secs' % round(winTime,1), (10, 30))]
+
+    if practice:
+       lines.append(('***PRACTICE RUN***', (10, 50)))
+    elif stats is None:
+       lines.append(('Average time: %s secs' % round(winTime,1), (10, 50)))
+    else:
+       lines.append(('Average time: %s secs' % round(stats.mean, 1), (10, 50)))
+    return lines
+
+
+def drawMouse(surf, x, y):
     mouseSegmentRect = pygame.Rect(x, y, CELLSIZE, CELLSIZE)
-    pygame.draw.rect(DISPLAYSURF, WHITE, mouseSegmentRect)
+    pygame.draw.rect(surf, WHITE, mouseSegmentRect)
     mouseInnerSegmentRect = pygame.Rect(x + 4, y + 4, CELLSIZE - 8, CELLSIZE - 8)
-    pygame.draw.rect(DISPLAYSURF, GRAY, mouseInnerSegmentRect)
+    pygame.draw.rect(surf, GRAY, mouseInnerSegmentRect)
 
 
-def drawCheese(coord):
-    x = coord['x'] * CELLSIZE
-    y = coord['y'] * CELLSIZE
+def drawCheese(surf, x, y):
     cheeseRect = pygame.Rect(x, y, CELLSIZE, CELLSIZE)
-    pygame.draw.rect(DISPLAYSURF, YELLOW, cheeseRect)
+    pygame.draw.rect(surf, YELLOW, cheeseRect)
 
 
-def drawGrid():
+def drawGrid(surf):
     for x in range(0, WINDOWWIDTH, CELLSIZE): # draw vertical lines
-        pygame.draw.line(DISPLAYSURF, DARKGRAY, (x, 0), (x, WINDOWHEIGHT))
+        pygame.draw.line(surf, DARKGRAY, (x, 0), (x, WINDOWHEIGHT))
     for y in range(0, WINDOWHEIGHT, CELLSIZE): # draw horizontal lines
-        pygame.draw.line(DISPLAYSURF, DARKGRAY, (0, y), (WINDOWWIDTH, y))
+        pygame.draw.line(surf, DARKGRAY, (0, y), (WINDOWWIDTH, y))
+
+
+# Which keys are held for each way a scripted player can walk
+HEADINGS = ((False, True, False, False), (True, False, False, False),
+            (False, False, False, True), (False, False, True, False),
+            (False, True, True, False), (False, True, False, True),
+            (True, False, True, False), (True, False, False, True))
+STOPPED = (False, False, False, False)
+
+
+class Player:
+    # A scripted participant for GameEngine. Each game tick keys() gets what a
+    # person would hear: the nav tone's (left, right) levels, and the spoken
+    # cue when one was just given (None otherwise). It returns which of
+    # left, right, up, down to hold. BatchPlayer follows the same rules for
+    # sweeps, so a change here has to be made there too.
+    navMode = NavMode.Sound
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.newTrial()
+
+    def newTrial(self):
+        self.heading = self.rng.choice(HEADINGS)
+
+    def keys(self, levels, cue):
+        return self.heading
+
+
+class RandomWalker(Player):
+    # Ignores the sound and picks a new way to go now and then
+    def keys(self, levels, cue):
+        if self.rng.random() < 0.1:
+            self.heading = self.rng.choice(HEADINGS)
+        return self.heading
+
+
+class VolumeClimber(Player):
+    # Keeps going while the tone doesn't get quieter (as heard through some
+    # noise), otherwise tries a new way. An unchanged tone means a wall.
+    NOISE = 0.002
+
+    def newTrial(self):
+        Player.newTrial(self)
+        self.lastVolume = None
+
+    def keys(self, levels, cue):
+        volume = max(levels) + self.rng.gauss(0.0, self.NOISE)
+        if self.lastVolume is not None and volume <= self.lastVolume:
+            self.heading = self.rng.choice(HEADINGS)
+        self.lastVolume = volume
+        return self.heading
+
+
+class TemperatureWalker(Player):
+    # Takes a few steps after each cue and waits for the next. Keeps the
+    # same way while told hotter; when told colder (or nothing) tries
+    # another way at random, taking fewer steps each time it is told colder.
+    navMode = NavMode.Temperature
+
+    def newTrial(self):
+        Player.newTrial(self)
+        self.runLength = max(1, int(round(GAME_FPS / SPEAK_FPS)) // 2)
+        self.stepsLeft = self.runLength
+        self.heard = False
+
+    def speakTick(self):
+        # A cue was due, whether or not one was said
+        self.heard = True
+
+    def keys(self, levels, cue):
+        if self.heard:
+            if cue == COLDER:
+                self.runLength = max(1, self.runLength // 2)
+            if cue != HOTTER:
+                self.heading = self.rng.choice([heading for heading in HEADINGS
+                                                if heading != self.heading])
+            self.stepsLeft = self.runLength
+            self.heard = False
+        if self.stepsLeft <= 0:
+            return STOPPED
+        self.stepsLeft -= 1
+        return self.heading
+
+
+class DirectionFollower(Player):
+    # Walks where it is told for a second at first, and half as long each
+    # time the next cue says it went too far
+    navMode = NavMode.Direction
+    OPPOSITES = {LEFT : RIGHT, RIGHT : LEFT, UP : DOWN, DOWN : UP}
+    WALKS = {RIGHT : HEADINGS[0], LEFT : HEADINGS[1], DOWN : HEADINGS[2], UP : HEADINGS[3]}
+
+    def newTrial(self):
+        self.runLength = max(1, int(round(GAME_FPS / SPEAK_FPS)))
+        self.stepsLeft = 0
+        self.lastCue = None
+        self.heading = STOPPED
+
+    def keys(self, levels, cue):
+        if cue is not None:
+            if self.OPPOSITES[cue] == self.lastCue:
+                self.runLength = max(1, self.runLength // 2)
+            self.heading = self.WALKS[cue]
+            self.stepsLeft = self.runLength
+            self.lastCue = cue
+        if self.stepsLeft <= 0:
+            return STOPPED
+        self.stepsLeft -= 1
+        return self.heading
+
+
+class StereoClimber(VolumeClimber):
+    # Like VolumeClimber but in Stereo mode, and turns toward the louder ear
+    navMode = NavMode.Stereo
+
+    def keys(self, levels, cue):
+        heading = VolumeClimber.keys(self, levels, cue)
+        left, right = levels
+        if abs(left - right) > self.NOISE * 4 and heading[0] == heading[1]:
+            # Not going sideways, so step toward the louder side
+            heading = (left > right, right > left, heading[2], heading[3])
+            self.heading = heading
+        return heading
+
+
+PLAYERS = collections.OrderedDict([('random', RandomWalker), ('volume', VolumeClimber),
+                                   ('stereo', StereoClimber), ('temperature', TemperatureWalker),
+                                   ('direction', DirectionFollower)])
+
+# The player a sweep uses for each nav mode
+MODEPLAYERS = {'Sound' : 'volume', 'Stereo' : 'stereo', 'Temperature' : 'temperature',
+               'Direction' : 'direction'}
+
+
+def playTrials(playerClass, trials, seed=None, navMode=None, maxSeconds=300.0):
+    # Let a scripted player play GameEngine flat out, in game time, until it
+    # has eaten the cheese trials times, not counting practice runs. Returns
+    # the TrialRecorder records and how many trials it gave up on after
+    # maxSeconds.
+    rng = random.Random(seed)
+    player = playerClass(random.Random(rng.random()))
+    if navMode is None:
+        navMode = player.navMode
+    engine = GameEngine(0.0, rng, navMode)
+    recorder = TrialRecorder(engine)
+    speakEvery = max(1, int(round(GAME_FPS / SPEAK_FPS)))
+    held = STOPPED
+    trialStart = 0.0
+    gaveUp = 0
+    played = 0
+    step = 0
+
+    while played < trials:
+        step += 1
+        now = step / GAME_FPS
+
+        # Speak first, like runGame() does when both come due together
+        cue = None
+        if step % speakEvery == 0 and engine.navMode not in NAVTONEMODES:
+            cue = engine.speak()
+            if hasattr(player, 'speakTick'):
+                player.speakTick()
+        wanted = player.keys(engine.levels, cue)
+        for key, wasDown, down in zip((LEFT, RIGHT, UP, DOWN), held, wanted):
+            if wasDown != down:
+                engine.press(key, down, now)
+        held = wanted
+
+        won = engine.step(now)
+        recorder.step(won)
+        if won:
+            if not recorder.trials[-1]['practice']:
+                played += 1
+            # Press space straight away
+            engine.resume()
+            held = STOPPED
+            player.newTrial()
+            trialStart = now
+        elif now - trialStart > maxSeconds:
+            gaveUp += 1
+            engine = GameEngine(now, rng, navMode)
+            recorder.begin(engine, (engine.mouseX, engine.mouseY))
+            held = STOPPED
+            player.newTrial()
+            trialStart = now
+    return recorder.trials, gaveUp
+
+
+def comparePlayers(names, trials, seed=None):
+    for name in names:
+        startTime = time.perf_counter()
+        records, gaveUp = playTrials(PLAYERS[name], trials, seed)
+        elapsed = time.perf_counter() - startTime
+        print(summarizeTrials(records, name))
+        print('  (%d gave up, %.1f secs to run)' % (gaveUp, elapsed))
+
+
+class BatchPlayer:
+    # The players in PLAYERS for a BatchSimulator, one per mouse, all moved
+    # at once with numpy. Each follows the same rules as the Player of that
+    # name (see there), hearing the same things at the same ticks, so
+    # --players and --sweep numbers can be compared. Call steer(speakNow)
+    # before each step, with speakNow on the same ticks as playTrials()
+    # speaks, and newTrials() with what the step returns.
+    OPPOSITES = (0, 2, 1, 4, 3) # of each of DIRECTIONCODES
+    # Each heading turned toward the left or right, if it is going up or down
+    TURNLEFT = (0, 1, 7, 6, 4, 5, 6, 7)
+    TURNRIGHT = (0, 1, 5, 4, 4, 5, 6, 7)
+
+    def __init__(self, sim, name, seed=None):
+        self.sim = sim
+        self.name = name
+        self.navMode = PLAYERS[name].navMode
+        self.headings = numpy.array(HEADINGS, dtype=bool)
+        self.rng = numpy.random.default_rng(seed)
+        self.fullRun = max(1, int(round(GAME_FPS / SPEAK_FPS)))
+        self.heading = numpy.zeros(sim.count, dtype=numpy.int64)
+        self.lastVolume = numpy.zeros(sim.count)
+        self.fresh = numpy.ones(sim.count, dtype=bool)
+        self.runLength = numpy.zeros(sim.count, dtype=numpy.int64)
+        self.stepsLeft = numpy.zeros(sim.count, dtype=numpy.int64)
+        self.lastCue = numpy.zeros(sim.count, dtype=numpy.int8)
+        self.newTrials(numpy.ones(sim.count, dtype=bool))
+
+    def newTrials(self, which):
+        # Player.newTrial() for the mice in which
+        if not which.any():
+            return
+        self.heading[which] = self.rng.integers(0, len(HEADINGS), int(which.sum()))
+        self.fresh[which] = True
+        self.lastCue[which] = 0
+        if self.name == 'temperature':
+            self.runLength[which] = max(1, self.fullRun // 2)
+            self.stepsLeft[which] = self.runLength[which]
+        else:
+            self.runLength[which] = self.fullRun
+            self.stepsLeft[which] = 0
+
+    def steer(self, speakNow):
+        # Set every mouse's keys for the next step
+        sim = self.sim
+        walking = numpy.ones(sim.count, dtype=bool)
+
+        if self.name == 'random':
+            self.newHeadings(self.rng.random(sim.count) < 0.1)
+
+        elif self.name in ('volume', 'stereo'):
+            # What the player hears is the louder ear
+            if self.navMode == NavMode.Stereo:
+                volume = numpy.maximum(sim.leftGain, sim.rightGain)
+            else:
+                volume = sim.volume
+            volume = volume + self.rng.normal(0.0, VolumeClimber.NOISE, sim.count)
+            self.newHeadings(~self.fresh & (volume <= self.lastVolume))
+            self.lastVolume = volume
+            self.fresh[:] = False
+            if self.name == 'stereo':
+                difference = sim.leftGain - sim.rightGain
+                turnLeft = difference > VolumeClimber.NOISE * 4
+                turnRight = difference < -VolumeClimber.NOISE * 4
+                self.heading[turnLeft] = numpy.take(self.TURNLEFT, self.heading[turnLeft])
+                self.heading[turnRight] = numpy.take(self.TURNRIGHT, self.heading[turnRight])
+
+        elif self.name == 'temperature':
+            if speakNow:
+                temperature, direction = sim.speak()
+                colder = temperature < 0
+                self.runLength[colder] = numpy.maximum(self.runLength[colder] // 2, 1)
+                # Anything but hotter: try another way
+                change = temperature <= 0
+                if change.any():
+                    self.heading[change] = (self.heading[change] +
+                                            self.rng.integers(1, len(HEADINGS), int(change.sum()))) % len(HEADINGS)
+                self.stepsLeft[:] = self.runLength
+            walking = self.stepsLeft > 0
+            self.stepsLeft -= walking
+
+        else:
+            if speakNow:
+                temperature, direction = sim.speak()
+                told = direction > 0
+                overshot = told & (direction == numpy.take(self.OPPOSITES, self.lastCue))
+                self.runLength[overshot] = numpy.maximum(self.runLength[overshot] // 2, 1)
+                # Direction codes 1-4 line up with the first four headings
+                self.heading[told] = direction[told] - 1
+                self.stepsLeft[told] = self.runLength[told]
+                self.lastCue[told] = direction[told]
+            walking = self.stepsLeft > 0
+            self.stepsLeft -= walking
+
+        keys = self.headings[self.heading] & walking[:, numpy.newaxis]
+        sim.left, sim.right, sim.up, sim.down = keys[:, 0], keys[:, 1], keys[:, 2], keys[:, 3]
+
+    def newHeadings(self, change):
+        if change.any():
+            self.heading[change] = self.rng.integers(0, len(HEADINGS), int(change.sum()))
+
+
+# Settings a sweep can change, and what they default to
+SWEEP_SETTINGS = ('GAME_FPS', 'SPEAK_FPS', 'CELLSIZE', 'SPAWN_DIVISOR', 'VOLUME_SCALE', 'VOLUME_POWER', 'navMode')
+
+
+def checkSetting(name, value):
+    # Why a sweep value won't work, or None if it will
+    if name == 'navMode':
+        if value not in NAVMODENAMES:
+            return 'navMode must be one of %s' % ', '.join(NAVMODENAMES)
+        return None
+    try:
+        number = int(value) if name == 'CELLSIZE' else float(value)
+    except ValueError:
+        return '%s must be a %s' % (name, 'whole number' if name == 'CELLSIZE' else 'number')
+    if number <= 0:
+        return '%s must be more than 0' % name
+    if name == 'CELLSIZE' and min(WINDOWWIDTH, WINDOWHEIGHT) // number < 11:
+        return 'CELLSIZE must leave at least 11 cells each way (at most %d)' % (min(WINDOWWIDTH, WINDOWHEIGHT) // 11)
+    return None
+
+
+def checkSpawn(settings):
+    # Why a configuration leaves some start cell with nowhere far enough away
+    # to put the cheese, or None if every start has somewhere. The farthest
+    # cell from any start is a corner of the grid.
+    cellSize = int(settings.get('CELLSIZE', CELLSIZE))
+    divisor = float(settings.get('SPAWN_DIVISOR', SPAWN_DIVISOR))
+    cellWidth = int(WINDOWWIDTH / cellSize)
+    cellHeight = int(WINDOWHEIGHT / cellSize)
+    minDistance = math.sqrt(cellWidth ** 2 + cellHeight ** 2) / divisor
+    for x in range(5, cellWidth - 5):
+        for y in range(5, cellHeight - 5):
+            farthest = math.sqrt(max(x, cellWidth - 1 - x) ** 2 + max(y, cellHeight - 1 - y) ** 2)
+            if farthest <= minDistance:
+                return ('SPAWN_DIVISOR %s leaves nowhere more than %.1f cells from (%d, %d) on a %dx%d grid'
+                        % (settings.get('SPAWN_DIVISOR', SPAWN_DIVISOR), minDistance, x, y, cellWidth, cellHeight))
+    return None
+
+
+def applySettings(settings):
+    # Change the game constants for this process. CELLSIZE keeps the window
+    # the same size, so it changes CELLWIDTH and CELLHEIGHT.
+    global CELLWIDTH, CELLHEIGHT, MAXDISTANCE
+    for name, value in settings.items():
+        if name != 'navMode':
+            globals()[name] = float(value) if name != 'CELLSIZE' else int(value)
+    CELLWIDTH = int(WINDOWWIDTH / CELLSIZE)
+    CELLHEIGHT = int(WINDOWHEIGHT / CELLSIZE)
+    MAXDISTANCE = math.sqrt ( CELLWIDTH ** 2 + CELLHEIGHT ** 2 )
+
+
+def runSweepUnit(unit):
+    # One chunk of work for a sweep: unit['mice'] batch players under one set
+    # of settings for unit['seconds'] of game time. Returns mergeable sums.
+    applySettings(unit['settings'])
+    seed = zlib.crc32(('%s/%d/%s' % (unit['key'], unit['chunk'], unit['seed'])).encode())
+    sim = BatchSimulator(unit['mice'], seed)
+    player = BatchPlayer(sim, MODEPLAYERS[unit['settings'].get('navMode', 'Sound')], seed + 1)
+    speakEvery = max(1, int(round(GAME_FPS / SPEAK_FPS)))
+    steps = int(unit['seconds'] * GAME_FPS)
+    for step in range(1, steps + 1):
+        # Speak on the same ticks as playTrials()
+        player.steer(step % speakEvery == 0)
+        player.newTrials(sim.step())
+    return {'key': unit['key'], 'chunk': unit['chunk'], 'settings': unit['settings'],
+            'mice': unit['mice'], 'seconds': unit['seconds'], 'seed': unit['seed'],
+            'wins': int(sim.score.sum()),
+            'winSeconds': float(sim.winSteps.sum()) / GAME_FPS,
+            'winSecondsSq': float(sim.winStepsSq.sum()) / GAME_FPS ** 2,
+            'mouseSteps': steps * unit['mice']}
+
+
+def sweep(settingArgs, outFile, chunks, mice, seconds, seed=None, workers=None):
+    # Run every combination of the settings (given as NAME=V1,V2,...) across
+    # a process pool. Each finished chunk is appended to outFile straight
+    # away, and chunks already in outFile are skipped, so a stopped sweep
+    # picks up where it left off. Only a sweep with the same mice, seconds and
+    # seed can pick up from outFile.
+    if numpy is None:
+        print('Sweeps need numpy', file=sys.stderr)
+        return
+    grid = [{}]
+    for arg in settingArgs:
+        name, values = arg.split('=', 1)
+        if name not in SWEEP_SETTINGS:
+            print('Unknown sweep setting %s, pick from %s' % (name, ', '.join(SWEEP_SETTINGS)), file=sys.stderr)
+            return
+        # Check every value here, a bad one would kill the pool part way through
+        for value in values.split(','):
+            problem = checkSetting(name, value)
+            if problem is not None:
+                print('Bad sweep value %s=%s: %s' % (name, value, problem), file=sys.stderr)
+                return
+        grid = [dict(settings, **{name: value}) for settings in grid for value in values.split(',')]
+    # SPAWN_DIVISOR only works with some grids, so check each combination
+    for settings in grid:
+        problem = checkSpawn(settings)
+        if problem is not None:
+            print('Bad sweep configuration %s: %s' % (json.dumps(settings, sort_keys=True), problem), file=sys.stderr)
+            return
+
+    done = set()
+    cutShort = False
+    if os.path.exists(outFile) and os.path.getsize(outFile) > 0:
+        for result in readSweepResults(outFile):
+            if (result.get('mice'), result.get('seconds'), result.get('seed')) != (mice, seconds, seed):
+                print('%s holds a sweep with --mice %s --seconds %s --seed %s, run it with those or use another --out'
+                      % (outFile, result.get('mice'), result.get('seconds'), result.get('seed')), file=sys.stderr)
+                return
+            done.add((result['key'], result['chunk']))
+        with open(outFile, 'rb') as resultFile:
+            resultFile.seek(-1, os.SEEK_END)
+            cutShort = resultFile.read(1) != b'\n'
+
+    units = []
+    for settings in grid:
+        key = json.dumps(settings, sort_keys=True)
+        for chunk in range(chunks):
+            if (key, chunk) not in done:
+                units.append({'key': key, 'chunk': chunk, 'settings': settings,
+                              'mice': mice, 'seconds': seconds, 'seed': seed})
+    print('%d configurations, %d chunks to run (%d already done)'
+          % (len(grid), len(units), len(grid) * chunks - len(units)), file=sys.stderr)
+
+    pool = multiprocessing.Pool(workers or multiprocessing.cpu_count())
+    try:
+        with open(outFile, 'a') as results:
+            if cutShort:
+                # Don't tack onto the end of a line cut short last time
+                results.write('\n')
+            for result in pool.imap_unordered(runSweepUnit, units):
+                results.write(json.dumps(result) + '\n')
+                results.flush()
+    finally:
+        pool.close()
+        pool.join()
+    print(summarizeSweep(outFile, chunks))
+
+
+def readSweepResults(outFile):
+    # Every complete result line in outFile. A line cut short when a sweep
+    # was killed is skipped, and that chunk gets run again.
+    results = []
+    with open(outFile) as resultFile:
+        for line in resultFile:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                pass
+    return results
+
+
+def summarizeSweep(outFile, chunks):
+    # Merge the first chunks chunks in outFile into one line per configuration
+    totals = collections.OrderedDict()
+    for result in readSweepResults(outFile):
+        if result['chunk'] >= chunks:
+            continue
+        total = totals.setdefault(result['key'], [0, 0.0, 0.0, 0, 0])
+        total[0] += result['wins']
+        total[1] += result['winSeconds']
+        total[2] += result['winSecondsSq']
+        total[3] += result['mouseSteps']
+        total[4] += 1
+    lines = []
+    for key, (wins, winSeconds, winSecondsSq, mouseSteps, chunks) in totals.items():
+        if wins > 0:
+            mean = winSeconds / wins
+            spread = math.sqrt(max(winSecondsSq / wins - mean ** 2, 0.0))
+            lines.append('%s: %d wins in %d chunks, %.2f +- %.2f secs to the cheese' % (key, wins, chunks, mean, spread))
+        else:
+            lines.append('%s: no wins in %d chunks (%d mouse-steps)' % (key, chunks, mouseSteps))
+    return '\n'.join(lines)
+
+
+def simulate(mice, steps, seed=None):
+    # Random walking mice in the batch simulator, to see how fast it goes
+    if numpy is None:
+        print('The batch simulator needs numpy', file=sys.stderr)
+        return
+    sim = BatchSimulator(mice, seed)
+    rng = numpy.random.default_rng(seed)
+    speakEvery = max(1, int(round(GAME_FPS / SPEAK_FPS)))
+    for step in range(steps):
+        if step % 5 == 0:
+            sim.left, sim.right, sim.up, sim.down = rng.random((4, mice)) < 0.25
+        sim.step()
+        if step % speakEvery == 0:
+            sim.speak()
+    print(sim.report())
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description=TITLE)
+    parser.add_argument('--simulate', nargs=2, type=int, metavar=('MICE', 'STEPS'),
+                        help='run random walking mice through the batch simulator and report its speed')
+    parser.add_argument('--sweep', nargs='+', metavar='NAME=V1,V2',
+                        help='simulate every combination of these settings: ' + ', '.join(SWEEP_SETTINGS))
+    parser.add_argument('--out', default='sweep.jsonl', help='where sweep results go (and resume from)')
+    parser.add_argument('--chunks', type=int, default=8, help='work units per sweep configuration')
+    parser.add_argument('--mice', type=int, default=1000, help='mice per sweep work unit')
+    parser.add_argument('--seconds', type=float, default=600.0, help='game seconds per sweep work unit')
+    parser.add_argument('--workers', type=int, help='sweep processes (default one per core)')
+    parser.add_argument('--players', nargs='*', choices=list(PLAYERS), metavar='PLAYER',
+                        help='let scripted players play TRIALS games each: ' + ', '.join(PLAYERS))
+    parser.add_argument('--trials', type=int, default=200, help='trials per scripted player')
+    parser.add_argument('--replay', metavar='FILE', help='play a recorded session again and check it matches')
+    parser.add_argument('--speed', type=float, default=0.0, help='how many times faster to replay (0 = flat out)')
+    parser.add_argument('--telemetry', metavar='FILE', help='summarize a telemetry log')
+    parser.add_argument('--heatmap', nargs='+', metavar=('DIR', 'KEY'),
+                        help='merge the visit heatmaps of every session in DIR and save them (or just KEY ...) as PNGs')
+    parser.add_argument('--participant', default='anonymous', help='who is playing, for the results database')
+    parser.add_argument('--results', metavar='DB', help='summarize a results database')
+    parser.add_argument('--seed', type=int, help='random seed for the game or simulations')
+    args = parser.parse_args()
+    if args.simulate:
+        simulate(args.simulate[0], args.simulate[1], args.seed)
+    elif args.players is not None:
+        comparePlayers(args.players or list(PLAYERS), args.trials, args.seed)
+    elif args.sweep:
+        sweep(args.sweep, args.out, args.chunks, args.mice, args.seconds, args.seed, args.workers)
+    elif args.results:
+        summarizeResults(args.results)
+    elif args.heatmap:
+        showHeatmaps(args.heatmap[0], args.heatmap[1:])
+    elif args.telemetry:
+        summarizeTelemetry(args.telemetry)
+    elif args.replay:
+        sys.exit(0 if replaySession(args.replay, args.speed) else 1)
+    else:
+        try:
+            main(args.seed, args.participant)
+        except (Exception, KeyboardInterrupt):
+            # Keep what was played, so a session that went wrong can be
+            # replayed
+            path = saveSession()
+            if path is not None:
+                print('session saved to %s' % path, file=sys.stderr)
+            raise